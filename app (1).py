@@ -6,15 +6,32 @@
 import streamlit as st
 import json
 import random
+import re
 import time
-import base64
-import os
-import subprocess
-import tempfile
+import asyncio
+import atexit
+import threading
+import hashlib
+import weakref
+import queue
+import concurrent.futures
+from collections import OrderedDict
 from pathlib import Path
 from dataclasses import dataclass, field
-from typing import Optional, Dict, List, Any
-import httpx
+from typing import Optional, Dict, List, Tuple, Any, Callable
+import aiohttp
+import edge_tts
+
+from audio.fish_audio import FishAudioTTS, VoiceConfig
+
+try:
+    import orjson
+    _json_loads = orjson.loads
+    _json_dumps = orjson.dumps
+except ImportError:  # orjson 未安装时退回标准库
+    _json_loads = json.loads
+    def _json_dumps(obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False).encode("utf-8")
 
 # ==================== 页面配置 ====================
 st.set_page_config(
@@ -28,12 +45,12 @@ st.set_page_config(
 BASE_DIR = Path(__file__).parent
 CONFIG_DIR = BASE_DIR / "config"
 
+@st.cache_resource
 def load_config(name: str) -> dict:
-    """加载配置文件"""
+    """加载配置文件（每个服务进程只解析一次，返回的字典不要修改）"""
     config_path = CONFIG_DIR / f"{name}.json"
     if config_path.exists():
-        with open(config_path, "r", encoding="utf-8") as f:
-            return json.load(f)
+        return _json_loads(config_path.read_bytes())
     return {}
 
 # 加载配置
@@ -64,130 +81,210 @@ DEFAULT_TOPICS = [
 ]
 
 # 平台信息
-PLATFORM_INFO = {
-    "douyin": {"name": "抖音", "icon": "🎵", "color": "#000000", "voice": "zh-CN-XiaoyiNeural"},
-    "zhihu": {"name": "知乎", "icon": "📚", "color": "#0066FF", "voice": "zh-CN-YunxiNeural"},
-    "xiaohongshu": {"name": "小红书", "icon": "📕", "color": "#FF2442", "voice": "zh-CN-XiaoxiaoNeural"},
-    "weibo": {"name": "微博", "icon": "🔥", "color": "#FF8200", "voice": "zh-CN-YunyangNeural"},
-    "x": {"name": "X/推特", "icon": "𝕏", "color": "#000000", "voice": "en-US-JennyNeural"},
-    "tieba": {"name": "贴吧", "icon": "🏛️", "color": "#4A90E2", "voice": "zh-CN-YunjianNeural"},
+@dataclass(frozen=True, slots=True)
+class PlatformInfo:
+    """平台展示信息（不可变，渲染时直接取属性）"""
+    name: str
+    icon: str
+    color: str
+    voice: str
+
+PLATFORM_INFO: Dict[str, PlatformInfo] = {
+    "douyin": PlatformInfo("抖音", "🎵", "#000000", "zh-CN-XiaoyiNeural"),
+    "zhihu": PlatformInfo("知乎", "📚", "#0066FF", "zh-CN-YunxiNeural"),
+    "xiaohongshu": PlatformInfo("小红书", "📕", "#FF2442", "zh-CN-XiaoxiaoNeural"),
+    "weibo": PlatformInfo("微博", "🔥", "#FF8200", "zh-CN-YunyangNeural"),
+    "x": PlatformInfo("X/推特", "𝕏", "#000000", "en-US-JennyNeural"),
+    "tieba": PlatformInfo("贴吧", "🏛️", "#4A90E2", "zh-CN-YunjianNeural"),
 }
 
+# 未知平台的兜底信息
+UNKNOWN_PLATFORM = PlatformInfo("平台", "💬", "#666666", "zh-CN-XiaoyiNeural")
+
+# 本模块专用的随机数生成器（不与其他库共享全局 random 状态）
+_RNG = random.Random()
+
+# 保留音频的最近消息条数（更早的消息只保留文字）
+AUDIO_KEEP_RECENT = 4
+
+# ==================== 异步运行时 ====================
+# Streamlit 每次 rerun 都会重新执行本脚本，模块级对象无法跨 rerun 保留，
+# 因此常驻事件循环和 HTTP 客户端都挂在 st.cache_resource 上，整个进程共享一份。
+
+@st.cache_resource
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """获取后台常驻事件循环"""
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
+
+def submit_async(coro) -> concurrent.futures.Future:
+    """把协程提交到后台事件循环，立即返回 Future（调用方可边等边做别的事）"""
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop())
+
+def run_async(coro):
+    """在后台事件循环中执行协程并阻塞等待结果"""
+    return submit_async(coro).result()
+
+async def _create_aiohttp_session() -> aiohttp.ClientSession:
+    # aiohttp 会话必须在其所属的事件循环内创建
+    return aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30))
+
+@st.cache_resource
+def get_aiohttp_session() -> aiohttp.ClientSession:
+    """获取共享的 aiohttp 会话（LLM 请求共用连接池，并发 POST 时比 httpx.AsyncClient 更不容易被串行化）"""
+    loop = get_event_loop()
+    session = run_async(_create_aiohttp_session())
+    
+    def _close():
+        if not session.closed:
+            asyncio.run_coroutine_threadsafe(session.close(), loop).result(timeout=5)
+    
+    atexit.register(_close)
+    return session
+
 # ==================== TTS 服务 ====================
 
-def generate_edge_tts_sync(text: str, voice: str) -> bytes:
-    """使用免费的 Edge TTS 生成语音（同步版本）"""
+async def generate_edge_tts_async(text: str, voice: str) -> Optional[bytes]:
+    """使用免费的 Edge TTS 生成语音（进程内直接调用，音频只在内存中流转）"""
     try:
-        # 使用命令行方式调用 edge-tts
-        with tempfile.NamedTemporaryFile(suffix='.mp3', delete=False) as f:
-            temp_path = f.name
-        
-        cmd = ['edge-tts', '--voice', voice, '--text', text, '--write-media', temp_path]
-        result = subprocess.run(cmd, capture_output=True, timeout=30)
-        
-        if result.returncode == 0 and os.path.exists(temp_path):
-            with open(temp_path, 'rb') as f:
-                audio_data = f.read()
-            os.unlink(temp_path)
-            return audio_data
-    except Exception as e:
+        communicate = edge_tts.Communicate(text, voice)
+        audio_data = bytearray()
+        async for chunk in communicate.stream():
+            if chunk["type"] == "audio":
+                audio_data.extend(chunk["data"])
+        if audio_data:
+            return bytes(audio_data)
+    except Exception:
         pass  # 语音生成失败时静默处理
     
     return None
 
-def generate_fish_audio_sync(text: str, api_key: str, voice_id: str) -> Optional[bytes]:
-    """使用 Fish Audio 生成用户语音（同步版本）"""
-    if not api_key or not voice_id:
+TTS_CACHE_SIZE = 256
+
+@st.cache_resource
+def get_tts_cache() -> "OrderedDict[str, bytes]":
+    """进程级 TTS 结果缓存（LRU），键为 文本+音色 的哈希"""
+    return OrderedDict()
+
+def _tts_key(text: str, voice: str) -> str:
+    return hashlib.blake2s(f"{voice}\n{text}".encode()).hexdigest()
+
+async def _synthesize_cached(cache: "OrderedDict[str, bytes]", text: str, voice: str) -> Optional[bytes]:
+    """命中缓存直接返回，否则合成并写入缓存（只在事件循环线程内读写，无需加锁）"""
+    key = _tts_key(text, voice)
+    audio = cache.get(key)
+    if audio is not None:
+        cache.move_to_end(key)
+        return audio
+    
+    audio = await generate_edge_tts_async(text, voice)
+    if audio:
+        cache[key] = audio
+        if len(cache) > TTS_CACHE_SIZE:
+            cache.popitem(last=False)
+    return audio
+
+async def _synthesize_replies(cache: "OrderedDict[str, bytes]",
+                              pairs: List[Tuple[str, str]]) -> List[Optional[bytes]]:
+    """并发合成多段 Edge TTS 语音，pairs 为 (文本, 音色)，结果顺序一致"""
+    return await asyncio.gather(*(_synthesize_cached(cache, text, voice) for text, voice in pairs))
+
+def _api_key_hash(api_key: str, person: bytes) -> str:
+    """API key 的完整摘要（用作缓存键，person 区分用途），不截断以免不同 key 撞到同一条缓存"""
+    return hashlib.blake2s(api_key.encode(), person=person).hexdigest()
+
+# 仍在缓存中的 Fish Audio 客户端（弱引用，被 cache_resource 淘汰后可回收），退出时统一关闭
+_FISH_CLIENTS: "weakref.WeakSet[FishAudioTTS]" = weakref.WeakSet()
+
+def _close_fish_clients():
+    clients = list(_FISH_CLIENTS)
+    if not clients:
+        return
+    try:
+        loop = get_event_loop()
+    except Exception:
+        return
+    for tts in clients:
+        try:
+            asyncio.run_coroutine_threadsafe(tts.close(), loop).result(timeout=5)
+        except Exception:
+            pass
+
+atexit.register(_close_fish_clients)
+
+@st.cache_resource(max_entries=16)
+def get_fish_tts(key_hash: str, _api_key: str) -> FishAudioTTS:
+    """
+    按 API key 共享的 Fish Audio 客户端（所有会话共用磁盘缓存索引和连接池）
+    _api_key 不参与缓存键，key_hash 须为 _api_key_hash 的完整摘要；
+    客户端的 aiohttp 会话在后台事件循环里首次合成时创建。
+    """
+    tts = FishAudioTTS(api_key=_api_key, cache_dir=str(BASE_DIR / "audio_cache"))
+    _FISH_CLIENTS.add(tts)
+    return tts
+
+async def generate_fish_audio_async(tts: Optional[FishAudioTTS], text: str, voice_id: str) -> Optional[bytes]:
+    """使用 Fish Audio 生成用户语音（异步版本，命中磁盘缓存时不发请求）"""
+    if tts is None or not voice_id:
         return None
     
     try:
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        payload = {
-            "text": text,
-            "reference_id": voice_id,
-            "format": "mp3",
-            "mp3_bitrate": 128,
-        }
-        
-        response = httpx.post(
-            "https://api.fish.audio/v1/tts",
-            headers=headers,
-            json=payload,
-            timeout=30.0
-        )
-        
-        if response.status_code == 200:
-            return response.content
+        return await tts.synthesize(text, VoiceConfig(reference_id=voice_id))
     except Exception:
-        pass  # 静默处理错误
-    
-    return None
-
-def get_audio_html(audio_data: bytes, autoplay: bool = True) -> str:
-    """生成自动播放的音频HTML"""
-    b64 = base64.b64encode(audio_data).decode()
-    autoplay_attr = "autoplay" if autoplay else ""
-    return f'<audio {autoplay_attr} controls style="height:30px;width:100%;"><source src="data:audio/mp3;base64,{b64}" type="audio/mp3"></audio>'
+        return None  # 静默处理错误
 
 # ==================== LLM API ====================
 
-def call_deepseek_sync(messages: List[Dict], api_key: str) -> str:
-    """调用 DeepSeek API（同步版本）"""
+async def _stream_chat(session: aiohttp.ClientSession, url: str, api_key: str, data: Dict,
+                       on_delta: Optional[Callable[[str], None]] = None) -> str:
+    """
+    以 SSE 流式调用 OpenAI 兼容的 chat/completions 接口，返回完整回复
+    每收到一段增量文本就回调 on_delta（在事件循环线程中调用，回调内不要碰 session_state）
+    """
     headers = {
         "Authorization": f"Bearer {api_key}",
         "Content-Type": "application/json"
     }
     
+    parts = []
+    async with session.post(url, headers=headers, data=_json_dumps({**data, "stream": True})) as response:
+        response.raise_for_status()
+        async for line in response.content:
+            if not line.startswith(b"data:"):
+                continue
+            payload = line[5:].strip()
+            if payload == b"[DONE]":
+                break
+            choices = _json_loads(payload).get("choices") or [{}]
+            delta = (choices[0].get("delta") or {}).get("content")
+            if delta:
+                parts.append(delta)
+                if on_delta:
+                    on_delta(delta)
+    return "".join(parts)
+
+async def call_deepseek_async(session: aiohttp.ClientSession, messages: List[Dict], api_key: str,
+                              on_delta: Optional[Callable[[str], None]] = None) -> str:
+    """调用 DeepSeek API（异步流式版本）"""
     data = {
         "model": "deepseek-chat",
         "messages": messages,
         "temperature": 0.8,
         "max_tokens": 500,
     }
-    
-    try:
-        response = httpx.post(
-            "https://api.deepseek.com/v1/chat/completions",
-            headers=headers,
-            json=data,
-            timeout=30.0
-        )
-        response.raise_for_status()
-        result = response.json()
-        return result["choices"][0]["message"]["content"]
-    except Exception as e:
-        return f"[API错误: {e}]"
+    return await _stream_chat(session, "https://api.deepseek.com/v1/chat/completions", api_key, data, on_delta)
 
-def call_zhipu_sync(messages: List[Dict], api_key: str) -> str:
-    """调用智谱 GLM-4 API（同步版本）"""
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
-    }
-    
+async def call_zhipu_async(session: aiohttp.ClientSession, messages: List[Dict], api_key: str,
+                           on_delta: Optional[Callable[[str], None]] = None) -> str:
+    """调用智谱 GLM-4 API（异步流式版本）"""
     data = {
         "model": "glm-4-flash",
         "messages": messages,
         "temperature": 0.8,
         "max_tokens": 500,
     }
-    
-    try:
-        response = httpx.post(
-            "https://open.bigmodel.cn/api/paas/v4/chat/completions",
-            headers=headers,
-            json=data,
-            timeout=30.0
-        )
-        response.raise_for_status()
-        result = response.json()
-        return result["choices"][0]["message"]["content"]
-    except Exception as e:
-        return f"[API错误: {e}]"
+    return await _stream_chat(session, "https://open.bigmodel.cn/api/paas/v4/chat/completions", api_key, data, on_delta)
 
 def mock_response(platform_id: str) -> str:
     """模拟回复（无API时使用）"""
@@ -199,12 +296,14 @@ def mock_response(platform_id: str) -> str:
         "x": ["This is actually quite nuanced...", "Interesting take. However...", "From a global perspective..."],
         "tieba": ["乐，经典话题", "典中典了属于是", "绷不住了，太真实"],
     }
-    return random.choice(responses.get(platform_id, ["..."]))
+    return _RNG.choice(responses.get(platform_id, ["..."]))
 
 # ==================== 自定义CSS ====================
 
-def load_custom_css():
-    st.markdown("""
+@st.cache_resource
+def _custom_css() -> str:
+    """样式表字符串（进程内只构建一次）"""
+    return """
     <style>
     /* 隐藏 Streamlit 默认元素 */
     #MainMenu {visibility: hidden;}
@@ -428,7 +527,11 @@ def load_custom_css():
         color: rgba(255,255,255,0.9);
     }
     </style>
-    """, unsafe_allow_html=True)
+    """
+
+def load_custom_css():
+    # Streamlit 每次 rerun 只保留本轮输出的元素，样式仍需每轮发送一次
+    st.markdown(_custom_css(), unsafe_allow_html=True)
 
 # ==================== 会话状态初始化 ====================
 
@@ -452,8 +555,9 @@ def init_session_state():
 
 # ==================== 核心功能 ====================
 
-def get_random_topics(count: int = 6) -> List[Dict]:
-    """获取随机话题"""
+@st.cache_resource
+def _flatten_topics() -> Tuple[Dict, ...]:
+    """把配置文件中的话题展开成一维元组（只计算一次）"""
     all_topics = []
     
     # 从配置文件加载
@@ -468,15 +572,23 @@ def get_random_topics(count: int = 6) -> List[Dict]:
     
     # 如果配置文件没有话题，使用内置话题
     if not all_topics:
-        all_topics = DEFAULT_TOPICS.copy()
+        all_topics = DEFAULT_TOPICS
     
-    return random.sample(all_topics, min(count, len(all_topics)))
+    return tuple(all_topics)
+
+def get_random_topics(count: int = 6) -> List[Dict]:
+    """获取随机话题"""
+    all_topics = _flatten_topics()
+    return _RNG.sample(all_topics, min(count, len(all_topics)))
 
+@st.cache_resource(max_entries=64)
 def build_system_prompt(platform_id: str, topic: str, other_platform: str) -> str:
-    """构建系统提示词"""
+    """构建系统提示词（同一组 平台/话题/对手 只拼接一次）"""
     platform = PLATFORMS.get(platform_id, {})
-    name = PLATFORM_INFO.get(platform_id, {}).get("name", platform_id)
-    other_name = PLATFORM_INFO.get(other_platform, {}).get("name", other_platform)
+    info = PLATFORM_INFO.get(platform_id)
+    other_info = PLATFORM_INFO.get(other_platform)
+    name = info.name if info else platform_id
+    other_name = other_info.name if other_info else other_platform
     
     traits = platform.get("core_traits", [])
     style = platform.get("speaking_style", {})
@@ -495,39 +607,112 @@ def build_system_prompt(platform_id: str, topic: str, other_platform: str) -> st
 
 注意：你是{name}，不是AI助手。直接以{name}的身份回复。"""
 
-def generate_ai_response(platform_id: str, topic: str, other_platform: str, history: List[Dict]) -> str:
-    """生成AI回复（同步版本）"""
+def build_chat_messages(platform_id: str, topic: str, other_platform: str, history: List[Dict]) -> List[Dict]:
+    """构建发送给 LLM 的消息列表"""
     system_prompt = build_system_prompt(platform_id, topic, other_platform)
     
     messages = [{"role": "system", "content": system_prompt}]
-    for msg in history[-10:]:  # 只用最近10条
+    append = messages.append
+    platform_info = PLATFORM_INFO
+    history_slice = history[-10:]  # 只用最近10条
+    for msg in history_slice:
+        content = msg.get("content", "")
         if msg.get("role") == "user":
-            messages.append({"role": "user", "content": msg.get("content", "")})
-        elif msg.get("platform_id") == platform_id:
-            messages.append({"role": "assistant", "content": msg.get("content", "")})
-        elif msg.get("platform_id") and msg.get("platform_id") in PLATFORM_INFO:
-            pid = msg.get("platform_id")
-            messages.append({"role": "user", "content": f"[{PLATFORM_INFO[pid]['name']}]: {msg.get('content', '')}"})
-    
-    # 尝试调用API
-    deepseek_key = st.session_state.get("deepseek_key", "")
-    zhipu_key = st.session_state.get("zhipu_key", "")
-    
-    if deepseek_key:
-        return call_deepseek_sync(messages, deepseek_key)
-    elif zhipu_key:
-        return call_zhipu_sync(messages, zhipu_key)
-    else:
+            append({"role": "user", "content": content})
+            continue
+        pid = msg.get("platform_id")
+        if pid == platform_id:
+            append({"role": "assistant", "content": content})
+        elif pid in platform_info:
+            append({"role": "user", "content": f"[{platform_info[pid].name}]: {content}"})
+    
+    return messages
+
+LLM_PROVIDERS = {
+    "deepseek": call_deepseek_async,
+    "zhipu": call_zhipu_async,
+}
+
+@st.cache_data(ttl=3600, max_entries=512, show_spinner=False)
+def _llm_reply(platform_id: str, msgs_tuple: Tuple[Tuple[str, str], ...],
+               provider: str, key_hash: str, _api_key: str,
+               _on_delta: Optional[Callable[[str], None]] = None) -> str:
+    """
+    带缓存的 LLM 调用
+    msgs_tuple 已包含系统提示词（平台、话题、对手），rerun 或重复输入时直接命中缓存；
+    _api_key、_on_delta 以下划线开头，不参与缓存键，只用 key_hash 区分不同密钥。
+    命中缓存时不会回调 _on_delta，直接返回完整文本。
+    调用失败时抛出异常，不会把错误写进缓存。
+    """
+    messages = [{"role": role, "content": content} for role, content in msgs_tuple]
+    call = LLM_PROVIDERS[provider]
+    return run_async(call(get_aiohttp_session(), messages, _api_key, _on_delta))
+
+async def generate_ai_response(platform_id: str, messages: List[Dict],
+                               deepseek_key: str, zhipu_key: str,
+                               on_delta: Optional[Callable[[str], None]] = None) -> str:
+    """生成AI回复（异步版本）"""
+    if not (deepseek_key or zhipu_key):
         return mock_response(platform_id)
+    
+    provider, api_key = ("deepseek", deepseek_key) if deepseek_key else ("zhipu", zhipu_key)
+    msgs_tuple = tuple((m["role"], m["content"]) for m in messages)
+    key_hash = _api_key_hash(api_key, b"llmcache")
+    
+    try:
+        # st.cache_data 只提供同步接口，放到线程里跑以免阻塞事件循环、保持两路并发
+        return await asyncio.to_thread(_llm_reply, platform_id, msgs_tuple, provider, key_hash, api_key, on_delta)
+    except Exception as e:
+        return f"[API错误: {e}]"
+
+async def _dispatch_replies(jobs: List[Tuple[str, List[Dict]]],
+                            deepseek_key: str, zhipu_key: str,
+                            deltas: Optional[queue.Queue] = None) -> List[str]:
+    """并发生成多个平台的回复，结果顺序与 jobs 一致；增量文本以 (平台, 片段) 放入 deltas 队列"""
+    def sink(pid: str) -> Optional[Callable[[str], None]]:
+        if deltas is None:
+            return None
+        return lambda text: deltas.put((pid, text))
+    
+    tasks = [
+        generate_ai_response(pid, messages, deepseek_key, zhipu_key, sink(pid))
+        for pid, messages in jobs
+    ]
+    return await asyncio.gather(*tasks)
+
+async def _dispatch_turn(fish_tts: Optional[FishAudioTTS], user_input: str, fish_voice: str,
+                         jobs: List[Tuple[str, List[Dict]]],
+                         deepseek_key: str, zhipu_key: str,
+                         deltas: Optional[queue.Queue] = None) -> Tuple[Optional[bytes], List[str]]:
+    """用户语音合成与各平台回复互不依赖，一起并发"""
+    return await asyncio.gather(
+        generate_fish_audio_async(fish_tts, user_input, fish_voice),
+        _dispatch_replies(jobs, deepseek_key, zhipu_key, deltas)
+    )
+
+_DEFAULT_BREAKPOINT_RESPONSES = ("...我...",)
+_NO_BREAKPOINT = (None, _DEFAULT_BREAKPOINT_RESPONSES)
+
+@st.cache_resource
+def _breakpoint_table() -> Dict[str, Tuple[Optional[re.Pattern], Tuple[str, ...]]]:
+    """
+    各平台的破防配置预处理（只做一次）
+    平台 -> (触发词合成的忽略大小写正则, 破防回复元组)
+    """
+    table = {}
+    for pid in PLATFORM_INFO:
+        secrets = SECRETS.get(pid, {})
+        triggers = secrets.get("breakpoint_triggers", [])
+        pattern = re.compile("|".join(re.escape(t) for t in triggers), re.IGNORECASE) if triggers else None
+        responses = tuple(secrets.get("breakpoint_responses", ())) or _DEFAULT_BREAKPOINT_RESPONSES
+        table[pid] = (pattern, responses)
+    return table
 
 def check_breakpoint(platform_id: str, user_message: str) -> bool:
     """检查是否触发破防"""
-    secrets = SECRETS.get(platform_id, {})
-    triggers = secrets.get("breakpoint_triggers", [])
-    
-    for trigger in triggers:
-        if trigger.lower() in user_message.lower():
-            return True
+    pattern, _ = _breakpoint_table().get(platform_id, _NO_BREAKPOINT)
+    if pattern is not None and pattern.search(user_message):
+        return True
     
     # 情绪值过低也触发
     emotion = st.session_state.emotions.get(platform_id, 70)
@@ -535,9 +720,8 @@ def check_breakpoint(platform_id: str, user_message: str) -> bool:
 
 def get_breakpoint_response(platform_id: str) -> str:
     """获取破防回复"""
-    secrets = SECRETS.get(platform_id, {})
-    responses = secrets.get("breakpoint_responses", ["...我..."])
-    return random.choice(responses)
+    _, responses = _breakpoint_table().get(platform_id, _NO_BREAKPOINT)
+    return _RNG.choice(responses)
 
 def update_emotion(platform_id: str, delta: int):
     """更新情绪值"""
@@ -547,26 +731,22 @@ def update_emotion(platform_id: str, delta: int):
 
 # ==================== UI 渲染 ====================
 
-def render_message(msg: Dict, autoplay_audio: bool = False):
-    """渲染单条消息"""
+def message_html(msg: Dict) -> str:
+    """生成单条消息的 HTML"""
     role = msg.get("role", "system")
     content = msg.get("content", "")
-    platform_id = msg.get("platform_id")
-    is_breakpoint = msg.get("is_breakpoint", False)
-    audio_data = msg.get("audio")
     
     if role == "system":
-        st.markdown(f"""
+        return f"""
         <div class="message system">
             <div class="message-content" style="width:100%;text-align:center;">
                 <div class="message-bubble">{content}</div>
             </div>
         </div>
-        """, unsafe_allow_html=True)
-        return
+        """
     
     if role == "user":
-        st.markdown(f"""
+        return f"""
         <div class="message user">
             <div class="message-avatar" style="background:#3b82f6;color:white;">👤</div>
             <div class="message-content">
@@ -574,31 +754,44 @@ def render_message(msg: Dict, autoplay_audio: bool = False):
                 <div class="message-bubble">{content}</div>
             </div>
         </div>
-        """, unsafe_allow_html=True)
-    else:
-        info = PLATFORM_INFO.get(platform_id, {"name": "平台", "icon": "💬", "color": "#666666"})
-        breakpoint_tag = '<span class="breakpoint-tag">💔 破防</span>' if is_breakpoint else ''
-        breakpoint_class = ' breakpoint' if is_breakpoint else ''
-        
-        color = info.get('color', '#666666')
-        icon = info.get('icon', '💬')
-        name = info.get('name', '平台')
-        
-        st.markdown(f"""
+        """
+    
+    info = PLATFORM_INFO.get(msg.get("platform_id"), UNKNOWN_PLATFORM)
+    is_breakpoint = msg.get("is_breakpoint", False)
+    breakpoint_tag = '<span class="breakpoint-tag">💔 破防</span>' if is_breakpoint else ''
+    breakpoint_class = ' breakpoint' if is_breakpoint else ''
+    
+    return f"""
         <div class="message platform{breakpoint_class}">
-            <div class="message-avatar" style="background:{color};color:white;">{icon}</div>
+            <div class="message-avatar" style="background:{info.color};color:white;">{info.icon}</div>
             <div class="message-content">
-                <div class="message-header">{name}</div>
+                <div class="message-header">{info.name}</div>
                 {breakpoint_tag}
                 <div class="message-bubble">{content}</div>
             </div>
         </div>
-        """, unsafe_allow_html=True)
+        """
+
+def render_messages(messages: List[Dict]):
+    """
+    渲染聊天记录
+    连续的消息拼成一段 HTML 一次性输出，只在带音频的消息处断开插入播放器，
+    旧消息的音频已被清理，整面聊天墙通常只需要几次 st.markdown。
+    """
+    last = len(messages) - 1
+    pending: List[str] = []
+    
+    for i, msg in enumerate(messages):
+        pending.append(message_html(msg))
+        audio_data = msg.get("audio")
+        if audio_data:
+            st.markdown("".join(pending), unsafe_allow_html=True)
+            pending.clear()
+            # 最后一条消息自动播放
+            st.audio(audio_data, format="audio/mp3", autoplay=(i == last))
     
-    # 音频播放
-    if audio_data:
-        audio_html = get_audio_html(audio_data, autoplay=autoplay_audio)
-        st.markdown(audio_html, unsafe_allow_html=True)
+    if pending:
+        st.markdown("".join(pending), unsafe_allow_html=True)
 
 def render_emotion_bar():
     """渲染情绪条"""
@@ -608,14 +801,13 @@ def render_emotion_bar():
     st.markdown('<div class="emotion-bar">', unsafe_allow_html=True)
     
     cols = st.columns(len(st.session_state.selected_platforms))
+    emotions = st.session_state.emotions
     for i, pid in enumerate(st.session_state.selected_platforms):
-        info = PLATFORM_INFO.get(pid, {"name": "平台", "icon": "💬", "color": "#666666"})
-        value = st.session_state.emotions.get(pid, 70)
+        icon = PLATFORM_INFO.get(pid, UNKNOWN_PLATFORM).icon
+        value = emotions.get(pid, 70)
         level = "high" if value > 60 else "medium" if value > 30 else "low"
         emoji = "😊" if value > 60 else "😐" if value > 30 else "😢"
         
-        icon = info.get('icon', '💬')
-        
         with cols[i]:
             st.markdown(f"""
             <div class="emotion-item">
@@ -642,7 +834,7 @@ def render_summary():
         {"name": "国际视野者", "desc": "你关注全球动态，思维开放"},
         {"name": "老互联网人", "desc": "你经历过互联网的黄金时代，见多识广"},
     ]
-    soul = random.choice(soul_types)
+    soul = _RNG.choice(soul_types)
     
     st.markdown(f"""
     <div class="soul-type">
@@ -654,11 +846,9 @@ def render_summary():
     # 平台成分
     st.markdown("### 📊 平台成分")
     for pid in st.session_state.selected_platforms:
-        info = PLATFORM_INFO.get(pid, {"name": "平台", "icon": "💬", "color": "#666666"})
-        score = random.randint(20, 80)
-        icon = info.get('icon', '💬')
-        name = info.get('name', '平台')
-        st.progress(score / 100, text=f"{icon} {name}: {score}%")
+        info = PLATFORM_INFO.get(pid, UNKNOWN_PLATFORM)
+        score = _RNG.randint(20, 80)
+        st.progress(score / 100, text=f"{info.icon} {info.name}: {score}%")
     
     # 毒舌点评
     roasts = [
@@ -669,7 +859,7 @@ def render_summary():
     ]
     st.markdown(f"""
     ### 💬 毒舌点评
-    > {random.choice(roasts)}
+    > {_RNG.choice(roasts)}
     """)
     
     st.markdown('</div>', unsafe_allow_html=True)
@@ -736,7 +926,7 @@ def main():
             with cols[i % 3]:
                 selected = pid in st.session_state.selected_platforms
                 if st.button(
-                    f"{info['icon']}\n{info['name']}", 
+                    f"{info.icon}\n{info.name}", 
                     key=f"platform_{pid}",
                     use_container_width=True,
                     type="primary" if selected else "secondary"
@@ -749,7 +939,7 @@ def main():
                     st.rerun()
         
         if st.session_state.selected_platforms:
-            names = [PLATFORM_INFO.get(p, {}).get("name", p) for p in st.session_state.selected_platforms]
+            names = [PLATFORM_INFO[p].name if p in PLATFORM_INFO else p for p in st.session_state.selected_platforms]
             st.success(f"已选: {' vs '.join(names)}")
         
         st.divider()
@@ -803,15 +993,15 @@ def main():
                 
                 # 添加开场消息
                 p1, p2 = st.session_state.selected_platforms
-                p1_info = PLATFORM_INFO.get(p1, {"icon": "💬", "name": "平台1"})
-                p2_info = PLATFORM_INFO.get(p2, {"icon": "💬", "name": "平台2"})
+                p1_info = PLATFORM_INFO.get(p1, UNKNOWN_PLATFORM)
+                p2_info = PLATFORM_INFO.get(p2, UNKNOWN_PLATFORM)
                 st.session_state.messages.append({
                     "role": "system",
                     "content": f"📢 群聊开始！话题：{st.session_state.current_topic}"
                 })
                 st.session_state.messages.append({
                     "role": "system",
-                    "content": f"{p1_info.get('icon', '💬')} {p1_info.get('name', '平台1')} 和 {p2_info.get('icon', '💬')} {p2_info.get('name', '平台2')} 加入了群聊"
+                    "content": f"{p1_info.icon} {p1_info.name} 和 {p2_info.icon} {p2_info.name} 加入了群聊"
                 })
                 st.rerun()
         else:
@@ -841,10 +1031,10 @@ def main():
     
     # 聊天头部
     p1, p2 = st.session_state.selected_platforms
-    p1_info = PLATFORM_INFO.get(p1, {"icon": "💬", "name": "平台1"})
-    p2_info = PLATFORM_INFO.get(p2, {"icon": "💬", "name": "平台2"})
+    p1_info = PLATFORM_INFO.get(p1, UNKNOWN_PLATFORM)
+    p2_info = PLATFORM_INFO.get(p2, UNKNOWN_PLATFORM)
     st.markdown(f"""
-    ### {p1_info.get('icon', '💬')} {p1_info.get('name', '平台1')} vs {p2_info.get('icon', '💬')} {p2_info.get('name', '平台2')}
+    ### {p1_info.icon} {p1_info.name} vs {p2_info.icon} {p2_info.name}
     **话题**: {st.session_state.current_topic}
     """)
     
@@ -856,10 +1046,7 @@ def main():
     # 消息列表
     chat_container = st.container()
     with chat_container:
-        for i, msg in enumerate(st.session_state.messages):
-            # 最后一条消息自动播放
-            autoplay = (i == len(st.session_state.messages) - 1) and msg.get("audio")
-            render_message(msg, autoplay_audio=autoplay)
+        render_messages(st.session_state.messages)
     
     # 输入区域
     st.divider()
@@ -879,59 +1066,104 @@ def main():
         handle_send_message_sync(user_input)
         st.rerun()
 
+def _render_streaming(future: concurrent.futures.Future, deltas: queue.Queue, pids: List[str]):
+    """
+    在脚本线程里边等待边把增量文本画到占位符上
+    流式回调发生在事件循环线程，只往队列里放数据，界面更新都在这里完成
+    """
+    placeholders = {pid: st.empty() for pid in pids}
+    texts = {pid: "" for pid in pids}
+    
+    while True:
+        done = future.done()
+        changed = set()
+        while True:
+            try:
+                pid, text = deltas.get_nowait()
+            except queue.Empty:
+                break
+            texts[pid] += text
+            changed.add(pid)
+        for pid in changed:
+            info = PLATFORM_INFO.get(pid, UNKNOWN_PLATFORM)
+            placeholders[pid].markdown(f"{info.icon} **{info.name}**：{texts[pid]}▌")
+        if done:
+            break
+        time.sleep(0.05)
+
 def handle_send_message_sync(user_input: str):
     """同步方式处理发送消息"""
     p1, p2 = st.session_state.selected_platforms
     
-    # 生成用户语音（Fish Audio）
-    user_audio = None
-    if st.session_state.get("fish_key") and st.session_state.get("fish_voice"):
-        user_audio = generate_fish_audio_sync(
-            user_input,
-            st.session_state.fish_key,
-            st.session_state.fish_voice
-        )
-    
-    # 添加用户消息
-    st.session_state.messages.append({
+    # 添加用户消息（语音稍后与平台回复并发生成）
+    user_msg = {
         "role": "user",
         "content": user_input,
-        "audio": user_audio
-    })
+        "audio": None
+    }
+    st.session_state.messages.append(user_msg)
+    
+    # 先在脚本线程里判断破防、准备 prompt（session_state 只能在这里访问）
+    breakpoints = {pid: check_breakpoint(pid, user_input) for pid in (p1, p2)}
+    jobs = [
+        (pid, build_chat_messages(
+            pid,
+            st.session_state.current_topic,
+            p2 if pid == p1 else p1,
+            st.session_state.messages
+        ))
+        for pid in (p1, p2) if not breakpoints[pid]
+    ]
     
-    # 两个平台依次回复
+    # 用户语音（Fish Audio）和两个平台的 AI 回复并发生成
+    fish_key = st.session_state.get("fish_key", "")
+    fish_tts = get_fish_tts(_api_key_hash(fish_key, b"fishtts"), fish_key) if fish_key else None
+    deltas: queue.Queue = queue.Queue()
+    future = submit_async(_dispatch_turn(
+        fish_tts,
+        user_input,
+        st.session_state.get("fish_voice", ""),
+        jobs,
+        st.session_state.get("deepseek_key", ""),
+        st.session_state.get("zhipu_key", ""),
+        deltas
+    ))
+    _render_streaming(future, deltas, [pid for pid, _ in jobs])
+    user_audio, results = future.result()
+    user_msg["audio"] = user_audio
+    replies = {pid: result for (pid, _), result in zip(jobs, results)}
+    
+    # 本轮需要的随机情绪波动一次性取好
+    mood_shifts = dict(zip((p1, p2), (_RNG.randint(-10, 5), _RNG.randint(-10, 5))))
+    
+    responses = {}
     for pid in [p1, p2]:
-        other = p2 if pid == p1 else p1
-        
-        # 检查破防
-        is_breakpoint = check_breakpoint(pid, user_input)
-        
-        if is_breakpoint:
-            response = get_breakpoint_response(pid)
+        if breakpoints[pid]:
+            responses[pid] = get_breakpoint_response(pid)
             update_emotion(pid, -30)
         else:
-            # 调用 AI 生成回复
-            response = generate_ai_response(
-                pid, 
-                st.session_state.current_topic,
-                other,
-                st.session_state.messages
-            )
-            update_emotion(pid, random.randint(-10, 5))
-        
-        # 生成AI语音（免费 Edge TTS）
-        audio_data = None
-        voice = PLATFORM_INFO.get(pid, {}).get("voice", "zh-CN-XiaoyiNeural")
-        audio_data = generate_edge_tts_sync(response, voice)
-        
+            responses[pid] = replies[pid]
+            update_emotion(pid, mood_shifts[pid])
+    
+    # 两个平台的AI语音（免费 Edge TTS）并发合成
+    audios = run_async(_synthesize_replies(get_tts_cache(), [
+        (responses[pid], PLATFORM_INFO.get(pid, UNKNOWN_PLATFORM).voice)
+        for pid in (p1, p2)
+    ]))
+    
+    for pid, audio_data in zip((p1, p2), audios):
         st.session_state.messages.append({
             "role": "platform",
             "platform_id": pid,
-            "content": response,
-            "is_breakpoint": is_breakpoint,
+            "content": responses[pid],
+            "is_breakpoint": breakpoints[pid],
             "audio": audio_data
         })
     
+    # 只保留最近几条消息的音频，旧消息的音频字节不再常驻 session_state
+    for msg in st.session_state.messages[:-AUDIO_KEEP_RECENT]:
+        msg.pop("audio", None)
+    
     st.session_state.turn_count += 1
 
 # ==================== 入口 ====================
@@ -6,8 +6,16 @@ import streamlit as st
 import json
 import random
 import time
+import asyncio
+import atexit
+import threading
+import queue
+import concurrent.futures
+import hashlib
+import itertools
 from pathlib import Path
-from typing import Optional, Dict, List
+from typing import Optional, Dict, List, Tuple, Callable, AsyncIterator, Iterator
+import httpx
 
 # ==================== 页面配置 ====================
 st.set_page_config(
@@ -92,6 +100,21 @@ MOCK_RESPONSES = {
     ],
 }
 
+_MOCK_FALLBACK = itertools.repeat("...")
+
+@st.cache_resource(show_spinner=False)
+def _mock_cycles() -> Dict[str, Iterator[str]]:
+    """每个平台一份预先打乱的模拟回复循环（进程内共享，rerun 不会重置）"""
+    cycles = {}
+    for pid, responses in MOCK_RESPONSES.items():
+        shuffled = list(responses)
+        random.Random(pid).shuffle(shuffled)
+        cycles[pid] = itertools.cycle(shuffled)
+    return cycles
+
+# 聊天区默认渲染的消息条数（“加载更早的消息”每次再多展开这么多条）
+MESSAGE_WINDOW = 50
+
 # ==================== 会话状态 ====================
 def init_session_state():
     if "messages" not in st.session_state:
@@ -106,47 +129,112 @@ def init_session_state():
         st.session_state.is_chatting = False
     if "topics" not in st.session_state:
         st.session_state.topics = random.sample(DEFAULT_TOPICS, 6)
+    if "message_window" not in st.session_state:
+        st.session_state.message_window = MESSAGE_WINDOW
 
-# ==================== API 调用 ====================
-def call_llm_api(messages: List[Dict], api_key: str, api_type: str) -> Optional[str]:
-    """调用 LLM API"""
-    try:
-        import httpx
-        
-        if api_type == "deepseek":
-            url = "https://api.deepseek.com/v1/chat/completions"
-            model = "deepseek-chat"
-        else:  # zhipu
-            url = "https://open.bigmodel.cn/api/paas/v4/chat/completions"
-            model = "glm-4-flash"
-        
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        data = {
-            "model": model,
-            "messages": messages,
-            "temperature": 0.8,
-            "max_tokens": 200,
-        }
-        
-        response = httpx.post(url, headers=headers, json=data, timeout=15.0)
-        if response.status_code == 200:
-            result = response.json()
-            return result["choices"][0]["message"]["content"]
-    except Exception as e:
-        pass  # 静默失败，使用模拟回复
+# ==================== 异步运行时 ====================
+# asyncio.run 每次都会新建并关闭事件循环，绑定在旧循环上的连接池无法复用；
+# 因此用一个常驻后台事件循环承载所有请求，HTTP 客户端挂在 st.cache_resource 上全进程共享。
+
+@st.cache_resource
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """获取后台常驻事件循环"""
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
+
+def submit_async(coro) -> concurrent.futures.Future:
+    """把协程提交到后台事件循环，立即返回 Future"""
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop())
+
+def run_async(coro):
+    """在后台事件循环中执行协程并阻塞等待结果"""
+    return submit_async(coro).result()
+
+async def _create_http_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(30.0),
+        limits=httpx.Limits(max_keepalive_connections=8)
+    )
+
+@st.cache_resource
+def get_http_client() -> httpx.AsyncClient:
+    """获取共享的 httpx.AsyncClient（跨 rerun、跨会话复用 TCP/TLS 连接）"""
+    loop = get_event_loop()
+    client = run_async(_create_http_client())
+    
+    def _close():
+        try:
+            asyncio.run_coroutine_threadsafe(client.aclose(), loop).result(timeout=5)
+        except Exception:
+            pass
     
-    return None
+    atexit.register(_close)
+    return client
 
-def get_ai_response(platform_id: str, topic: str, history: List[Dict]) -> str:
-    """获取AI回复"""
-    # 检查是否有API key
-    deepseek_key = st.session_state.get("deepseek_key", "")
-    zhipu_key = st.session_state.get("zhipu_key", "")
+# ==================== API 调用 ====================
+async def stream_llm_api(client: httpx.AsyncClient, messages: List[Dict], api_key: str, api_type: str) -> AsyncIterator[str]:
+    """流式调用 LLM API（SSE），逐段产出增量文本"""
+    if api_type == "deepseek":
+        url = "https://api.deepseek.com/v1/chat/completions"
+        model = "deepseek-chat"
+    else:  # zhipu
+        url = "https://open.bigmodel.cn/api/paas/v4/chat/completions"
+        model = "glm-4-flash"
     
+    headers = {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json"
+    }
+    
+    data = {
+        "model": model,
+        "messages": messages,
+        "temperature": 0.8,
+        "max_tokens": 200,
+        "stream": True,
+    }
+    
+    async with client.stream("POST", url, headers=headers, json=data) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            payload = line[5:].strip()
+            if payload == "[DONE]":
+                break
+            choices = json.loads(payload).get("choices") or [{}]
+            delta = (choices[0].get("delta") or {}).get("content")
+            if delta:
+                yield delta
+
+async def call_llm_api(client: httpx.AsyncClient, messages: List[Dict], api_key: str, api_type: str,
+                       on_delta: Optional[Callable[[str], None]] = None) -> str:
+    """调用 LLM API，收到增量文本时回调 on_delta，返回完整回复；失败或空回复时抛出异常"""
+    parts = []
+    async for delta in stream_llm_api(client, messages, api_key, api_type):
+        parts.append(delta)
+        if on_delta:
+            on_delta(delta)
+    if not parts:
+        raise ValueError("empty LLM response")
+    return "".join(parts)
+
+@st.cache_data(ttl=3600, max_entries=512, show_spinner=False)
+def _cached_llm(api_type: str, api_key_hash: str, messages_tuple: Tuple[Tuple[str, str], ...],
+                _client: httpx.AsyncClient, _api_key: str, _on_delta: Optional[Callable[[str], None]] = None) -> str:
+    """
+    带缓存的 LLM 调用，缓存键为 (接口类型, key 哈希, 完整消息)
+    下划线开头的参数不参与缓存键：密钥本身不会进入缓存，命中缓存时也不会回调 _on_delta。
+    调用失败时抛出异常，不会把失败结果写进缓存。
+    """
+    messages = [{"role": role, "content": content} for role, content in messages_tuple]
+    return run_async(call_llm_api(_client, messages, _api_key, api_type, _on_delta))
+
+async def get_ai_response(client: httpx.AsyncClient, platform_id: str, topic: str, history: List[Dict],
+                          deepseek_key: str, zhipu_key: str, mock_cycles: Dict[str, Iterator[str]],
+                          on_delta: Optional[Callable[[str], None]] = None) -> str:
+    """获取AI回复（在后台事件循环中运行，API key 和模拟回复循环由调用方在脚本线程取好传入）"""
     if deepseek_key or zhipu_key:
         # 构建提示
         platform_name = PLATFORM_INFO[platform_id]["name"]
@@ -176,12 +264,58 @@ def get_ai_response(platform_id: str, topic: str, history: List[Dict]) -> str:
         api_key = deepseek_key if deepseek_key else zhipu_key
         api_type = "deepseek" if deepseek_key else "zhipu"
         
-        result = call_llm_api(messages, api_key, api_type)
-        if result:
-            return result
+        messages_tuple = tuple((m["role"], m["content"]) for m in messages)
+        api_key_hash = hashlib.blake2s(api_key.encode(), person=b"llmcache").hexdigest()[:16]
+        try:
+            # st.cache_data 只有同步接口，放到线程里跑，避免阻塞事件循环
+            return await asyncio.to_thread(
+                _cached_llm, api_type, api_key_hash, messages_tuple, client, api_key, on_delta
+            )
+        except (httpx.HTTPError, KeyError, ValueError):
+            pass  # 网络/接口/解析错误时静默失败，使用模拟回复
     
     # 使用模拟回复
-    return random.choice(MOCK_RESPONSES.get(platform_id, ["..."]))
+    return next(mock_cycles.get(platform_id, _MOCK_FALLBACK))
+
+async def generate_replies(client: httpx.AsyncClient, platform_ids: List[str], topic: str, history: List[Dict],
+                           deepseek_key: str, zhipu_key: str, mock_cycles: Dict[str, Iterator[str]],
+                           deltas: queue.Queue) -> List[str]:
+    """并发生成各平台回复，结果顺序与 platform_ids 一致；增量文本以 (平台, 片段) 放入 deltas"""
+    def sink(pid: str) -> Callable[[str], None]:
+        return lambda delta: deltas.put((pid, delta))
+    
+    return await asyncio.gather(*(
+        get_ai_response(client, pid, topic, history, deepseek_key, zhipu_key, mock_cycles, sink(pid))
+        for pid in platform_ids
+    ))
+
+def render_streaming(future: concurrent.futures.Future, deltas: queue.Queue, platform_ids: List[str]):
+    """
+    在脚本线程里边等待边把增量文本画到占位符上
+    回调发生在后台事件循环线程，只往队列里放数据，界面更新都在这里完成
+    """
+    placeholders = {}
+    for pid in platform_ids:
+        with st.chat_message("assistant", avatar=_CHAT_AVATARS.get(pid)):
+            placeholders[pid] = st.empty()
+    texts = {pid: "" for pid in platform_ids}
+    
+    while True:
+        done = future.done()
+        changed = set()
+        while True:
+            try:
+                pid, delta = deltas.get_nowait()
+            except queue.Empty:
+                break
+            texts[pid] += delta
+            changed.add(pid)
+        for pid in changed:
+            info = PLATFORM_INFO[pid]
+            placeholders[pid].markdown(f"**{info['name']}**  \n{texts[pid]}▌")
+        if done:
+            break
+        time.sleep(0.05)
 
 # ==================== 消息处理 ====================
 def send_message(user_input: str):
@@ -197,69 +331,69 @@ def send_message(user_input: str):
         "content": user_input
     })
     
-    # 2. 平台1回复
-    response1 = get_ai_response(p1, st.session_state.current_topic, st.session_state.messages)
+    # 2. 两个平台并发回复（边生成边显示）
+    deltas: queue.Queue = queue.Queue()
+    future = submit_async(generate_replies(
+        get_http_client(),
+        [p1, p2],
+        st.session_state.current_topic,
+        st.session_state.messages[-6:],
+        st.session_state.get("deepseek_key", ""),
+        st.session_state.get("zhipu_key", ""),
+        _mock_cycles(),  # st.cache_resource 需要脚本线程上下文，不能在后台事件循环里调用
+        deltas
+    ))
+    render_streaming(future, deltas, [p1, p2])
+    response1, response2 = future.result()
     st.session_state.messages.append({
         "role": "platform",
         "platform_id": p1,
         "content": response1
     })
-    
-    # 更新情绪
-    st.session_state.emotions[p1] = max(0, st.session_state.emotions.get(p1, 70) + random.randint(-10, 5))
-    
-    # 3. 平台2回复
-    response2 = get_ai_response(p2, st.session_state.current_topic, st.session_state.messages)
     st.session_state.messages.append({
         "role": "platform",
         "platform_id": p2,
         "content": response2
     })
     
-    # 更新情绪
-    st.session_state.emotions[p2] = max(0, st.session_state.emotions.get(p2, 70) + random.randint(-10, 5))
+    # 3. 更新情绪（两个平台算好后一次性写回）
+    new_emotions = dict(st.session_state.emotions)
+    for pid in (p1, p2):
+        new_emotions[pid] = max(0, new_emotions.get(pid, 70) + random.randint(-10, 5))
+    st.session_state.emotions = new_emotions
 
 # ==================== UI ====================
+_CSS = """
+<style>
+.message-system {
+    text-align: center;
+    color: #888;
+    font-size: 0.9em;
+    margin: 10px 0;
+}
+</style>
+"""
+
+# 平台选择按钮文字
+_BUTTON_LABELS = {pid: f"{info['icon']}\n{info['name']}" for pid, info in PLATFORM_INFO.items()}
+
+# st.chat_message 的头像只接受 emoji / 图片，“𝕏” 不是 emoji，换成 🐦
+_CHAT_AVATARS = {pid: info["icon"] for pid, info in PLATFORM_INFO.items()}
+_CHAT_AVATARS["x"] = "🐦"
+
+_WELCOME_HTML = """
+<div style="text-align:center;padding:100px 20px;">
+    <div style="font-size:80px;margin-bottom:20px;">💬</div>
+    <h2>选择平台和话题，开始群聊！</h2>
+    <p style="color:#888;">让AI平台们吵起来，看看谁会先破防！</p>
+</div>
+"""
+
 def main():
     init_session_state()
     
-    # 自定义CSS
-    st.markdown("""
-    <style>
-    .message-user {
-        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-        color: white;
-        padding: 10px 15px;
-        border-radius: 15px;
-        margin: 5px 0;
-        max-width: 70%;
-        margin-left: auto;
-    }
-    .message-platform {
-        background: #f0f0f0;
-        color: #333;
-        padding: 10px 15px;
-        border-radius: 15px;
-        margin: 5px 0;
-        max-width: 70%;
-    }
-    .message-system {
-        text-align: center;
-        color: #888;
-        font-size: 0.9em;
-        margin: 10px 0;
-    }
-    .platform-icon {
-        display: inline-block;
-        width: 30px;
-        height: 30px;
-        border-radius: 8px;
-        text-align: center;
-        line-height: 30px;
-        margin-right: 8px;
-    }
-    </style>
-    """, unsafe_allow_html=True)
+    # 自定义CSS（Streamlit 每次 rerun 只保留本轮输出的元素，样式仍需每轮发送）
+    st.markdown(_CSS, unsafe_allow_html=True)
     
     # ===== 侧边栏 =====
     with st.sidebar:
@@ -283,11 +417,12 @@ def main():
         # 平台选择
         st.subheader("1️⃣ 选择两个平台")
         cols = st.columns(3)
-        for i, (pid, info) in enumerate(PLATFORM_INFO.items()):
+        selected_set = set(st.session_state.selected_platforms)
+        for i, (pid, label) in enumerate(_BUTTON_LABELS.items()):
             with cols[i % 3]:
-                selected = pid in st.session_state.selected_platforms
+                selected = pid in selected_set
                 if st.button(
-                    f"{info['icon']}\n{info['name']}", 
+                    label, 
                     key=f"p_{pid}",
                     use_container_width=True,
                     type="primary" if selected else "secondary"
@@ -330,6 +465,7 @@ def main():
             if st.button("🚀 开始群聊", disabled=not can_start, type="primary", use_container_width=True):
                 st.session_state.is_chatting = True
                 st.session_state.messages = []
+                st.session_state.message_window = MESSAGE_WINDOW
                 p1, p2 = st.session_state.selected_platforms
                 st.session_state.messages.append({
                     "role": "system",
@@ -350,15 +486,17 @@ def main():
     
     # ===== 主聊天区域 =====
     if not st.session_state.is_chatting:
-        st.markdown("""
-        <div style="text-align:center;padding:100px 20px;">
-            <div style="font-size:80px;margin-bottom:20px;">💬</div>
-            <h2>选择平台和话题，开始群聊！</h2>
-            <p style="color:#888;">让AI平台们吵起来，看看谁会先破防！</p>
-        </div>
-        """, unsafe_allow_html=True)
+        st.markdown(_WELCOME_HTML, unsafe_allow_html=True)
         return
     
+    chat_panel()
+
+@st.fragment
+def chat_panel():
+    """
+    聊天面板：情绪条、消息列表和输入框
+    作为 fragment 运行，发送消息时只重跑这一块，侧边栏和样式不受影响
+    """
     # 显示情绪条
     if st.session_state.selected_platforms:
         cols = st.columns(2)
@@ -371,34 +509,30 @@ def main():
     
     st.divider()
     
-    # 显示消息
-    for msg in st.session_state.messages:
-        if msg["role"] == "system":
-            st.markdown(f"<div class='message-system'>{msg['content']}</div>", unsafe_allow_html=True)
-        elif msg["role"] == "user":
-            st.markdown(f"<div style='text-align:right'><div class='message-user'>{msg['content']}</div></div>", unsafe_allow_html=True)
-        elif msg["role"] == "platform":
-            pid = msg.get("platform_id", "")
-            info = PLATFORM_INFO.get(pid, {"icon": "💬", "name": "平台", "color": "#666"})
-            st.markdown(f"""
-            <div>
-                <span class='platform-icon' style='background:{info["color"]};color:white;'>{info["icon"]}</span>
-                <strong>{info["name"]}</strong>
-            </div>
-            <div class='message-platform'>{msg["content"]}</div>
-            """, unsafe_allow_html=True)
+    # 显示消息（只渲染最近 message_window 条，完整历史仍保留在 session_state 里供 LLM 使用）
+    messages = st.session_state.messages
+    window = st.session_state.message_window
+    if len(messages) > window:
+        if st.button(f"⬆️ 加载更早的消息（还有 {len(messages) - window} 条）", use_container_width=True):
+            st.session_state.message_window += MESSAGE_WINDOW
+            st.rerun(scope="fragment")
     
-    st.divider()
+    with st.container(height=500):
+        for msg in messages[-window:]:
+            if msg["role"] == "system":
+                st.markdown(f"<div class='message-system'>{msg['content']}</div>", unsafe_allow_html=True)
+            elif msg["role"] == "user":
+                with st.chat_message("user"):
+                    st.markdown(msg["content"])
+            elif msg["role"] == "platform":
+                pid = msg.get("platform_id", "")
+                with st.chat_message("assistant", avatar=_CHAT_AVATARS.get(pid)):
+                    st.markdown(f"**{PLATFORM_INFO.get(pid, {}).get('name', '平台')}**  \n{msg['content']}")
     
-    # 输入框
-    col1, col2 = st.columns([5, 1])
-    with col1:
-        user_input = st.text_input("说点什么...", key="input", label_visibility="collapsed")
-    with col2:
-        if st.button("发送", type="primary", use_container_width=True):
-            if user_input:
-                send_message(user_input)
-                st.rerun()
+    # 输入框（回车即发送）
+    if user_input := st.chat_input("说点什么..."):
+        send_message(user_input)
+        st.rerun(scope="fragment")
 
 if __name__ == "__main__":
     main()
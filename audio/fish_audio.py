@@ -9,9 +9,10 @@ import json
 import os
 import hashlib
 import base64
+import uuid
 from pathlib import Path
-from dataclasses import dataclass
-from typing import Optional, List, Dict, Any
+from dataclasses import dataclass, replace
+from typing import Optional, List, Dict, Any, Tuple
 from enum import Enum
 
 
@@ -26,9 +27,9 @@ class EmotionTone(Enum):
     SARCASTIC = "sarcastic"  # 阴阳怪气
 
 
-@dataclass
+@dataclass(frozen=True)
 class VoiceConfig:
-    """语音配置"""
+    """语音配置（不可变，可在多次合成间共享）"""
     reference_id: str        # Fish Audio 参考音频ID（你的唱歌声音）
     speed: float = 1.0       # 语速 0.5-2.0
     pitch: float = 0         # 音调 -12 到 12
@@ -138,10 +139,43 @@ PLATFORM_VOICE_CONFIGS = {
 }
 
 
+def _flatten_voice_configs() -> Tuple[Dict[str, VoiceConfig], Dict[Tuple[str, str], VoiceConfig]]:
+    """
+    把嵌套的平台语音配置展开成现成的 VoiceConfig 模板（reference_id 留空）
+    返回 (平台 -> 基础配置, (平台, 情绪) -> 情绪配置)
+    """
+    base_configs = {}
+    flat = {}
+    for pid, cfg in PLATFORM_VOICE_CONFIGS.items():
+        base = cfg["base"]
+        base_configs[pid] = VoiceConfig(
+            reference_id="",
+            speed=base["speed"],
+            pitch=base["pitch"],
+            energy=base["energy"],
+            pause_between=base["pause_between"]
+        )
+        for emotion, mods in cfg["emotion_modifiers"].items():
+            flat[(pid, emotion)] = VoiceConfig(
+                reference_id="",
+                speed=mods.get("speed", base["speed"]),
+                pitch=mods.get("pitch", base["pitch"]),
+                energy=mods.get("energy", base["energy"]),
+                emotion=emotion,
+                pause_between=base["pause_between"]
+            )
+    return base_configs, flat
+
+
+_BASE_VOICE_CONFIGS, _FLAT_VOICE_CONFIGS = _flatten_voice_configs()
+
+
 class FishAudioTTS:
     """Fish Audio TTS 客户端"""
     
     API_BASE = "https://api.fish.audio"
+    MAX_CONCURRENT_REQUESTS = 4  # 分条合成时的最大并发请求数
+    STREAM_CHUNK_SIZE = 16 * 1024  # 写缓存时每次读取的字节数
     
     def __init__(
         self,
@@ -154,6 +188,19 @@ class FishAudioTTS:
         self.cache_dir = Path(cache_dir)
         self.cache_dir.mkdir(parents=True, exist_ok=True)
         
+        # 已缓存音频的文件名索引（启动时扫描一次目录，之后不再逐次 stat）
+        with os.scandir(self.cache_dir) as entries:
+            self._cache_index = {e.name for e in entries if e.name.endswith(".mp3")}
+        
+        # 语音配置缓存 (平台, 情绪, 音色ID) -> VoiceConfig
+        self._voice_configs: Dict[Tuple[str, str, str], VoiceConfig] = {}
+        
+        # 共享的 HTTP 会话（首次请求时在当前事件循环中创建）
+        self._http: Optional[aiohttp.ClientSession] = None
+        
+        # 正在合成中的请求（缓存文件名 -> 任务），相同文本和配置只调用一次 API
+        self._inflight: Dict[str, asyncio.Task] = {}
+        
         # 加载平台配置
         self.platform_configs = PLATFORM_VOICE_CONFIGS
         
@@ -172,16 +219,31 @@ class FishAudioTTS:
         # 优先使用平台专属音色，否则使用默认音色
         return self.platform_voice_ids.get(platform_id, "") or self.default_voice_id
     
+    async def _session(self) -> aiohttp.ClientSession:
+        """获取共享会话，复用连接池和 TLS 连接"""
+        if self._http is None or self._http.closed:
+            self._http = aiohttp.ClientSession(
+                headers={"Authorization": f"Bearer {self.api_key}"},
+                timeout=aiohttp.ClientTimeout(total=30),
+                connector=aiohttp.TCPConnector(limit=16, ttl_dns_cache=300)
+            )
+        return self._http
+    
+    async def close(self):
+        """关闭共享会话"""
+        http = getattr(self, "_http", None)
+        if http is not None and not http.closed:
+            await http.close()
+    
     def is_enabled(self) -> bool:
         """检查TTS是否可用"""
         return bool(self.api_key)
     
     def _get_cache_path(self, text: str, config: VoiceConfig) -> Path:
         """获取缓存路径"""
-        # 基于文本和配置生成唯一hash
-        config_str = f"{config.speed}_{config.pitch}_{config.energy}_{config.emotion}"
-        hash_input = f"{text}_{config_str}"
-        file_hash = hashlib.md5(hash_input.encode()).hexdigest()[:12]
+        # 基于文本和配置生成唯一hash（只用作文件名，不需要密码学强度）
+        key = f"{text}|{config.reference_id}|{config.speed}|{config.pitch}|{config.energy}|{config.emotion}".encode()
+        file_hash = hashlib.blake2b(key, digest_size=6).hexdigest()
         return self.cache_dir / f"{file_hash}.mp3"
     
     def get_voice_config(
@@ -189,25 +251,26 @@ class FishAudioTTS:
         platform_id: str,
         emotion_level: str = "neutral"
     ) -> VoiceConfig:
-        """获取平台语音配置"""
+        """获取平台语音配置（按 平台/情绪/音色 缓存，返回的配置不可变）"""
         if platform_id not in self.platform_configs:
             platform_id = "douyin"  # 默认
         
-        config = self.platform_configs[platform_id]
-        base = config["base"]
-        modifiers = config["emotion_modifiers"].get(emotion_level, {})
-        
         # 使用平台专属音色ID
         voice_id = self.get_voice_id_for_platform(platform_id)
         
-        return VoiceConfig(
-            reference_id=voice_id,
-            speed=modifiers.get("speed", base["speed"]),
-            pitch=modifiers.get("pitch", base["pitch"]),
-            energy=modifiers.get("energy", base["energy"]),
-            emotion=emotion_level,
-            pause_between=base["pause_between"]
-        )
+        key = (platform_id, emotion_level, voice_id)
+        cached = self._voice_configs.get(key)
+        if cached is not None:
+            return cached
+        
+        template = _FLAT_VOICE_CONFIGS.get((platform_id, emotion_level))
+        if template is None:
+            # 未定义的情绪：使用平台基础参数
+            template = replace(_BASE_VOICE_CONFIGS[platform_id], emotion=emotion_level)
+        
+        voice_config = replace(template, reference_id=voice_id)
+        self._voice_configs[key] = voice_config
+        return voice_config
     
     async def synthesize(
         self,
@@ -218,15 +281,38 @@ class FishAudioTTS:
         """合成语音"""
         # 检查缓存
         cache_path = self._get_cache_path(text, config)
-        if use_cache and cache_path.exists():
-            return cache_path.read_bytes()
+        if use_cache and cache_path.name in self._cache_index:
+            try:
+                return await asyncio.to_thread(cache_path.read_bytes)
+            except FileNotFoundError:
+                # 缓存文件被外部删除，移出索引后重新合成
+                self._cache_index.discard(cache_path.name)
         
-        # 调用 Fish Audio API
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
+        if not use_cache:
+            return await self._request_audio(text, config, None)
         
+        # 同一事件循环里已有相同请求在进行时直接等它的结果
+        # （任务绑定事件循环，不同循环之间不共享）
+        key = cache_path.name
+        loop = asyncio.get_running_loop()
+        task = self._inflight.get(key)
+        if task is None or task.get_loop() is not loop:
+            task = loop.create_task(self._request_audio(text, config, cache_path))
+            self._inflight[key] = task
+            task.add_done_callback(
+                lambda t: self._inflight.pop(key, None) if self._inflight.get(key) is t else None
+            )
+        # shield：某个调用方被取消时不影响其他等待同一结果的调用方
+        return await asyncio.shield(task)
+    
+    async def _request_audio(
+        self,
+        text: str,
+        config: VoiceConfig,
+        cache_path: Optional[Path]
+    ) -> bytes:
+        """调用 Fish Audio API 合成，cache_path 不为空时边收边写缓存"""
+        # 调用 Fish Audio API
         payload = {
             "text": text,
             "reference_id": config.reference_id,
@@ -242,23 +328,36 @@ class FishAudioTTS:
             }
         }
         
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                f"{self.API_BASE}/v1/tts",
-                headers=headers,
-                json=payload
-            ) as response:
-                if response.status != 200:
-                    error_text = await response.text()
-                    raise Exception(f"TTS API error: {response.status} - {error_text}")
-                
-                audio_data = await response.read()
-        
-        # 保存缓存
-        if use_cache:
-            cache_path.write_bytes(audio_data)
+        session = await self._session()
+        async with session.post(
+            f"{self.API_BASE}/v1/tts",
+            json=payload
+        ) as response:
+            if response.status != 200:
+                error_text = await response.text()
+                raise Exception(f"TTS API error: {response.status} - {error_text}")
+            
+            if cache_path is None:
+                return await response.read()
+            
+            # 边收边写缓存：先写临时文件，完整收完再改名，避免留下半截的缓存
+            # 临时文件名各不相同，并发写同一条缓存时互不覆盖
+            chunks = []
+            part_path = cache_path.with_name(f"{cache_path.stem}.{uuid.uuid4().hex}.part")
+            f = await asyncio.to_thread(open, part_path, "wb")
+            try:
+                async for chunk in response.content.iter_chunked(self.STREAM_CHUNK_SIZE):
+                    chunks.append(chunk)
+                    await asyncio.to_thread(f.write, chunk)
+            except BaseException:
+                await asyncio.to_thread(f.close)
+                part_path.unlink(missing_ok=True)
+                raise
+            await asyncio.to_thread(f.close)
         
-        return audio_data
+        await asyncio.to_thread(part_path.replace, cache_path)
+        self._cache_index.add(cache_path.name)
+        return b"".join(chunks)
     
     async def synthesize_multi_part(
         self,
@@ -271,22 +370,26 @@ class FishAudioTTS:
         返回每条消息的音频数据和时间信息
         """
         config = self.get_voice_config(platform_id, emotion_level)
-        results = []
+        indexed = [(i, part) for i, part in enumerate(parts) if part.strip()]
         
-        for i, part in enumerate(parts):
-            if not part.strip():
-                continue
-            
-            audio_data = await self.synthesize(part, config)
-            
-            results.append({
+        # 各条互不依赖，并发合成；用信号量限制同时请求数，避免触发限流
+        semaphore = asyncio.Semaphore(self.MAX_CONCURRENT_REQUESTS)
+        
+        async def synthesize_part(part: str) -> bytes:
+            async with semaphore:
+                return await self.synthesize(part, config)
+        
+        audios = await asyncio.gather(*(synthesize_part(part) for _, part in indexed))
+        
+        return [
+            {
                 "index": i,
                 "text": part,
                 "audio": audio_data,
                 "pause_after": config.pause_between if i < len(parts) - 1 else 0
-            })
-        
-        return results
+            }
+            for (i, part), audio_data in zip(indexed, audios)
+        ]
     
     async def synthesize_with_emotion_shift(
         self,
@@ -367,9 +470,8 @@ class VoiceManager:
     ) -> Dict[str, Any]:
         """处理私信语音（悄悄话感觉，音量略低）"""
         config = self.tts.get_voice_config(platform_id, "neutral")
-        # 降低音量模拟悄悄话
-        config.energy *= 0.7
-        config.speed *= 0.95
+        # 降低音量模拟悄悄话（配置是共享的，复制一份再改）
+        config = replace(config, energy=config.energy * 0.7, speed=config.speed * 0.95)
         
         audio_data = await self.tts.synthesize(content, config)
         return {
@@ -384,6 +486,10 @@ class VoiceManager:
         return base64.b64encode(audio_data).decode('utf-8')
 
 
+# 模拟客户端返回的最小有效 MP3 帧头
+_MOCK_MP3_BYTES = b'\xff\xfb\x90\x00' + b'\x00' * 100
+
+
 class MockFishAudioTTS(FishAudioTTS):
     """
     模拟 TTS 客户端（用于测试，不实际调用API）
@@ -392,8 +498,10 @@ class MockFishAudioTTS(FishAudioTTS):
     def __init__(self, *args, **kwargs):
         self.reference_id = kwargs.get('reference_id', 'mock_ref')
         self.platform_configs = PLATFORM_VOICE_CONFIGS
+        self._voice_configs = {}
         self.cache_dir = Path('./audio_cache')
-        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        if not self.cache_dir.is_dir():
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
     
     async def synthesize(
         self,
@@ -402,8 +510,7 @@ class MockFishAudioTTS(FishAudioTTS):
         use_cache: bool = True
     ) -> bytes:
         """模拟返回空音频"""
-        # 返回一个最小的有效MP3文件头
-        return b'\xff\xfb\x90\x00' + b'\x00' * 100
+        return _MOCK_MP3_BYTES
 
 
 def create_tts_client(
@@ -6,16 +6,44 @@
 
 import json
 import os
+import re
 import random
 import time
 import asyncio
+import hashlib
+import functools
+import sqlite3
+import threading
+from collections import OrderedDict, deque
 from pathlib import Path
-from typing import Optional, Dict, List, Tuple, Any, Generator
+from typing import Optional, Dict, List, Tuple, Any, Generator, AsyncIterator, Deque
 from dataclasses import dataclass, field
 from enum import Enum
+from types import MappingProxyType
 import logging
 from abc import ABC, abstractmethod
 
+import http_pool
+
+try:
+    import orjson
+    _json_loads = orjson.loads
+    def _json_dumps(obj: Any, indent: bool = False, sort_keys: bool = False) -> bytes:
+        option = orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, option=option)
+except ImportError:  # orjson 未安装时退回标准库（输出格式与 orjson 保持一致）
+    _json_loads = json.loads
+    def _json_dumps(obj: Any, indent: bool = False, sort_keys: bool = False) -> bytes:
+        return json.dumps(
+            obj, ensure_ascii=False, sort_keys=sort_keys,
+            indent=2 if indent else None,
+            separators=(",", ": ") if indent else (",", ":")
+        ).encode("utf-8")
+
 # 配置日志
 logging.basicConfig(
     level=logging.INFO,
@@ -36,8 +64,7 @@ def load_config(name: str) -> dict:
     """加载配置文件"""
     config_path = CONFIG_DIR / f"{name}.json"
     if config_path.exists():
-        with open(config_path, "r", encoding="utf-8") as f:
-            return json.load(f)
+        return _json_loads(config_path.read_bytes())
     return {}
 
 # 加载所有配置
@@ -46,6 +73,221 @@ RELATIONSHIPS = load_config("relationships")
 TOPICS = load_config("topics")
 SECRETS = load_config("secrets")
 
+def _flatten_relationships(relationships: Dict) -> Dict[Tuple[str, str], Dict]:
+    """把关系配置展开为 (平台, 对方平台) -> 关系
+    
+    同时支持 "a_to_b" 扁平键和 {a: {b: ...}} 嵌套两种写法。
+    """
+    flat = {}
+    for key, value in relationships.items():
+        source, sep, target = key.partition("_to_")
+        if sep:
+            flat[(source, target)] = value
+        elif isinstance(value, dict):
+            for target, relation in value.items():
+                if isinstance(relation, dict):
+                    flat[(key, target)] = relation
+    return flat
+
+# 平台关系表按 (a, b) 元组索引，避免每次拼接键名和多层查找
+_RELATIONSHIP_MAP = _flatten_relationships(RELATIONSHIPS.get("relationships", {}))
+_EMPTY_RELATIONSHIP = MappingProxyType({})
+
+# 扁平化的话题池（配置加载后不再变化，导入时构建一次）
+_ALL_TOPICS: Tuple[Dict, ...] = tuple(
+    {
+        "category": category,
+        "title": topic.get("title", topic.get("topic", str(topic))),
+        "description": topic.get("description", ""),
+    }
+    for category, topics in TOPICS.items() if isinstance(topics, list)
+    for topic in topics if isinstance(topic, dict)
+)
+
+# ==================== LLM 响应缓存 ====================
+
+class LLMCache:
+    """LLM 响应缓存：内存 LRU 前置 + SQLite 持久化（带过期时间）
+    
+    键为请求体（模型、消息、采样参数）的 sha256，完全相同的请求直接返回上次结果。
+    """
+    
+    # 采样温度过高时结果本应多样，不做缓存
+    MAX_CACHEABLE_TEMPERATURE = 0.9
+    
+    # 每写入这么多条清理一次过期行（打开数据库时也会清理一次）
+    PURGE_EVERY = 500
+    
+    def __init__(self, db_path: Path, ttl: float = 7 * 24 * 3600, memory_size: int = 256):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.memory_size = memory_size
+        self._memory: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()      # 保护内存 LRU（只在事件循环里短暂持有）
+        self._db_lock = threading.Lock()   # 串行化 SQLite 访问（在工作线程里持有）
+        self._conn: Optional[sqlite3.Connection] = None
+        self._writes = 0
+    
+    def _db(self) -> sqlite3.Connection:
+        """延迟打开数据库连接，打开时顺带清理过期行（调用方持有 _db_lock）"""
+        if self._conn is None:
+            conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+            with conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS llm_cache "
+                    "(key TEXT PRIMARY KEY, response TEXT NOT NULL, expires_at REAL NOT NULL)"
+                )
+                conn.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (time.time(),))
+            self._conn = conn
+        return self._conn
+    
+    @staticmethod
+    def make_key(data: Dict) -> str:
+        """根据请求体生成缓存键"""
+        return hashlib.sha256(_json_dumps(data, sort_keys=True)).hexdigest()
+    
+    @classmethod
+    def is_cacheable(cls, data: Dict) -> bool:
+        """判断该请求是否适合缓存"""
+        return data.get("temperature", 0) <= cls.MAX_CACHEABLE_TEMPERATURE
+    
+    async def get(self, key: str) -> Optional[str]:
+        """读取缓存，未命中或已过期返回 None（只有查 SQLite 时才切到工作线程）"""
+        now = time.time()
+        with self._lock:
+            hit = self._memory.get(key)
+            if hit is not None:
+                response, expires_at = hit
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    return response
+                del self._memory[key]
+        
+        row = await asyncio.to_thread(self._db_get, key)
+        if row is None or row[1] <= now:
+            return None
+        with self._lock:
+            self._remember(key, row[0], row[1])
+        return row[0]
+    
+    async def set(self, key: str, response: str):
+        """写入缓存（内存立即生效，SQLite 在工作线程里写）"""
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._remember(key, response, expires_at)
+        await asyncio.to_thread(self._db_set, key, response, expires_at)
+    
+    def _db_get(self, key: str) -> Optional[Tuple[str, float]]:
+        """从 SQLite 读取一行"""
+        try:
+            with self._db_lock:
+                return self._db().execute(
+                    "SELECT response, expires_at FROM llm_cache WHERE key = ?", (key,)
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"LLM cache read error: {e}")
+            return None
+    
+    def _db_set(self, key: str, response: str, expires_at: float):
+        """写入 SQLite，每 PURGE_EVERY 次写入顺带清理过期行"""
+        try:
+            with self._db_lock, self._db() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO llm_cache (key, response, expires_at) VALUES (?, ?, ?)",
+                    (key, response, expires_at)
+                )
+                self._writes += 1
+                if self._writes % self.PURGE_EVERY == 0:
+                    conn.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (time.time(),))
+        except sqlite3.Error as e:
+            logger.warning(f"LLM cache write error: {e}")
+    
+    def _remember(self, key: str, response: str, expires_at: float):
+        """写入内存 LRU（调用方持有 _lock）"""
+        self._memory[key] = (response, expires_at)
+        self._memory.move_to_end(key)
+        if len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+llm_cache = LLMCache(DATA_DIR / "llm_cache.db")
+
+# ==================== 限速与重试 ====================
+
+class RateLimiter:
+    """按服务商的 RPM/TPM 滑动窗口限速，并用 AIMD 动态调整并发上限
+    
+    被限流（429）时并发上限减半；请求延迟低于目标时每满一个窗口加 1。
+    """
+    
+    WINDOW = 60.0
+    
+    def __init__(self, rpm: int, tpm: Optional[int] = None, max_concurrency: int = 10,
+                 target_latency: float = 2.0):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_concurrency = max_concurrency
+        self.target_latency = target_latency
+        self.limit = float(max_concurrency)  # 当前并发上限
+        self._in_flight = 0
+        self._window: deque = deque()  # (发出时间, 估算 token 数)
+        self._window_tokens = 0
+        self._cond = asyncio.Condition()
+    
+    def _window_wait(self, now: float, tokens: int) -> float:
+        """当前窗口还需等待多久才能再发一个请求"""
+        while self._window and self._window[0][0] <= now - self.WINDOW:
+            self._window_tokens -= self._window.popleft()[1]
+        if not self._window:
+            return 0.0
+        if len(self._window) >= self.rpm or (
+            self.tpm is not None and self._window_tokens + tokens > self.tpm
+        ):
+            return self._window[0][0] + self.WINDOW - now
+        return 0.0
+    
+    async def acquire(self, tokens: int):
+        """等待并发与窗口配额"""
+        async with self._cond:
+            while True:
+                if self._in_flight >= int(self.limit):
+                    await self._cond.wait()
+                    continue
+                now = time.monotonic()
+                wait = self._window_wait(now, tokens)
+                if wait <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(self._cond.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+            self._in_flight += 1
+            self._window.append((now, tokens))
+            self._window_tokens += tokens
+    
+    async def release(self, latency: float, throttled: bool = False):
+        """归还并发名额并按 AIMD 调整上限"""
+        async with self._cond:
+            self._in_flight -= 1
+            if throttled:
+                self.limit = max(1.0, self.limit * 0.5)
+            elif latency <= self.target_latency:
+                self.limit = min(float(self.max_concurrency), self.limit + 1.0 / self.limit)
+            self._cond.notify_all()
+
+def _estimate_tokens(data: Dict) -> int:
+    """粗略估算请求消耗的 token 数（中文约一字一 token）"""
+    prompt = sum(len(m.get("content", "")) for m in data.get("messages", []))
+    return prompt + data.get("max_tokens", 0)
+
+def _retry_delay(attempt: int, retry_after: Optional[str] = None) -> float:
+    """指数退避（带抖动），服务端给了 Retry-After 时优先使用"""
+    if retry_after:
+        try:
+            return min(float(retry_after), 30.0)
+        except ValueError:
+            pass
+    return min(8.0, 0.5 * 2 ** attempt) * (0.5 + random.random())
+
 # ==================== LLM API 封装 ====================
 
 class LLMProvider(ABC):
@@ -60,209 +302,328 @@ class LLMProvider(ABC):
     async def generate_stream(self, messages: List[Dict], **kwargs) -> Generator[str, None, None]:
         """流式生成回复"""
         pass
+    
+    # 空闲时定期探活的间隔（秒），需短于连接池的 keepalive_expiry
+    KEEPALIVE_INTERVAL = 240.0
+    
+    def _get_client(self):
+        """获取进程内共享的 httpx.AsyncClient，并为该服务商启动探活任务"""
+        target = (self.base_url, self.api_key)
+        if target not in _KEEPALIVE_TARGETS:
+            _KEEPALIVE_TARGETS.add(target)
+            task = asyncio.create_task(_keepalive(self, self.KEEPALIVE_INTERVAL))
+            _KEEPALIVE_TASKS.add(task)
+            task.add_done_callback(_KEEPALIVE_TASKS.discard)
+        return http_pool.get()
+
+    # 服务商限速配置，子类覆盖
+    RATE_LIMIT: Dict[str, Any] = {"rpm": 60}
+    # 需要重试的状态码与最大重试次数
+    RETRY_STATUS = frozenset({429, 500, 502, 503})
+    MAX_RETRIES = 3
+    
+    def _get_limiter(self) -> RateLimiter:
+        """获取该提供者类共享的限速器"""
+        cls = type(self)
+        if "_limiter" not in cls.__dict__:
+            cls._limiter = RateLimiter(**cls.RATE_LIMIT)
+        return cls._limiter
+    
+    async def _request(self, data: Dict) -> Dict:
+        """发送 /chat/completions 请求：限速，遇到限流/服务端错误/超时时退避重试"""
+        import httpx
+        
+        limiter = self._get_limiter()
+        tokens = _estimate_tokens(data)
+        for attempt in range(self.MAX_RETRIES + 1):
+            last_attempt = attempt == self.MAX_RETRIES
+            retry_after = None
+            throttled = False
+            await limiter.acquire(tokens)
+            started = time.monotonic()
+            try:
+                response = await self._get_client().post(
+                    self._completions_url, headers=self._headers, json=data
+                )
+                throttled = response.status_code == 429
+                if last_attempt or response.status_code not in self.RETRY_STATUS:
+                    response.raise_for_status()
+                    return _json_loads(response.content)
+                retry_after = response.headers.get("retry-after")
+            except (httpx.TimeoutException, httpx.ConnectError):
+                if last_attempt:
+                    raise
+            finally:
+                await limiter.release(time.monotonic() - started, throttled)
+            
+            delay = _retry_delay(attempt, retry_after)
+            logger.warning(f"{type(self).__name__} request retry {attempt + 1} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+    
+    async def _stream(self, data: Dict) -> AsyncIterator[str]:
+        """发送流式 /chat/completions 请求并产出增量文本
+        
+        与 _request 相同的限速和退避重试；已经产出内容后出错不再重试（避免重复输出），
+        非重试状态码直接抛出 httpx.HTTPStatusError，而不是把错误响应当成空回复。
+        """
+        import httpx
+        
+        limiter = self._get_limiter()
+        tokens = _estimate_tokens(data)
+        for attempt in range(self.MAX_RETRIES + 1):
+            last_attempt = attempt == self.MAX_RETRIES
+            retry_after = None
+            throttled = False
+            yielded = False
+            await limiter.acquire(tokens)
+            started = time.monotonic()
+            try:
+                async with self._get_client().stream(
+                    "POST",
+                    self._completions_url,
+                    headers=self._headers,
+                    json=data,
+                    timeout=60.0
+                ) as response:
+                    throttled = response.status_code == 429
+                    if last_attempt or response.status_code not in self.RETRY_STATUS:
+                        response.raise_for_status()
+                        async for delta in _iter_sse_deltas(response):
+                            yielded = True
+                            yield delta
+                        return
+                    retry_after = response.headers.get("retry-after")
+            except (httpx.TimeoutException, httpx.ConnectError):
+                if last_attempt or yielded:
+                    raise
+            finally:
+                await limiter.release(time.monotonic() - started, throttled)
+            
+            delay = _retry_delay(attempt, retry_after)
+            logger.warning(f"{type(self).__name__} stream retry {attempt + 1} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+def _parse_sse_delta(payload: bytes) -> Optional[str]:
+    """解析一帧 SSE data 负载，返回增量文本；无内容或格式不对时返回 None"""
+    try:
+        chunk = _json_loads(payload)
+        delta = (chunk.get("choices") or [{}])[0].get("delta") or {}
+        return delta.get("content") or None
+    except (ValueError, KeyError, IndexError, TypeError, AttributeError) as e:
+        logger.debug(f"Skip malformed SSE frame: {e}")
+        return None
+
+async def _iter_sse_deltas(response) -> AsyncIterator[str]:
+    """解析 OpenAI 兼容的 SSE 流，产出增量文本
+    
+    在字节缓冲区上按换行切帧，每帧只做一次前缀判断和一次 JSON 解析。
+    """
+    buf = bytearray()
+    async for chunk in response.aiter_bytes():
+        buf += chunk
+        start = 0
+        while (end := buf.find(b"\n", start)) != -1:
+            if buf.startswith(b"data: ", start, end):
+                payload = buf[start + 6:end].strip()
+                if payload == b"[DONE]":
+                    return
+                content = _parse_sse_delta(payload)
+                if content:
+                    yield content
+            start = end + 1
+        del buf[:start]
+    # 最后一帧可能没有换行就断流了
+    if buf.startswith(b"data: "):
+        payload = buf[6:].strip()
+        if payload != b"[DONE]":
+            content = _parse_sse_delta(payload)
+            if content:
+                yield content
+
+# 各服务商的探活任务，按 (base_url, api_key) 去重
+_KEEPALIVE_TARGETS: set = set()
+_KEEPALIVE_TASKS: set = set()
+
+async def _keepalive(provider: LLMProvider, interval: float):
+    """定期请求 /models，让空闲期间到该服务商的 TLS 连接保持可用"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await http_pool.get().get(
+                f"{provider.base_url}/models", headers=provider._headers, timeout=10.0
+            )
+        except Exception as e:
+            logger.debug(f"LLM keepalive ping failed: {e}")
 
 class DeepSeekAPI(LLMProvider):
     """DeepSeek API封装"""
     
+    RATE_LIMIT = {"rpm": 60, "tpm": 120_000, "max_concurrency": 10}
+    
     def __init__(self, api_key: Optional[str] = None):
         self.api_key = api_key or os.getenv("DEEPSEEK_API_KEY", "")
         self.base_url = "https://api.deepseek.com/v1"
+        self._completions_url = f"{self.base_url}/chat/completions"
+        self._headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
         self.model = "deepseek-chat"
+        self._base_data = {"model": self.model}
     
     async def generate(self, messages: List[Dict], **kwargs) -> str:
         """生成回复"""
-        import httpx
-        
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-        
         data = {
-            "model": self.model,
+            **self._base_data,
             "messages": messages,
             "temperature": kwargs.get("temperature", 0.8),
             "max_tokens": kwargs.get("max_tokens", 500),
             "top_p": kwargs.get("top_p", 0.9),
         }
         
-        async with httpx.AsyncClient() as client:
-            try:
-                response = await client.post(
-                    f"{self.base_url}/chat/completions",
-                    headers=headers,
-                    json=data,
-                    timeout=30.0
-                )
-                response.raise_for_status()
-                result = response.json()
-                return result["choices"][0]["message"]["content"]
-            except Exception as e:
-                logger.error(f"DeepSeek API error: {e}")
-                return ""
+        cache_key = llm_cache.make_key(data) if llm_cache.is_cacheable(data) else None
+        if cache_key:
+            cached = await llm_cache.get(cache_key)
+            if cached is not None:
+                return cached
+        
+        try:
+            result = await self._request(data)
+            content = result["choices"][0]["message"]["content"]
+        except Exception as e:
+            logger.error(f"DeepSeek API error: {e}")
+            return ""
+        
+        if cache_key and content:
+            await llm_cache.set(cache_key, content)
+        return content
     
     async def generate_stream(self, messages: List[Dict], **kwargs) -> Generator[str, None, None]:
         """流式生成"""
-        import httpx
-        
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-        
         data = {
-            "model": self.model,
+            **self._base_data,
             "messages": messages,
             "temperature": kwargs.get("temperature", 0.8),
             "max_tokens": kwargs.get("max_tokens", 500),
             "stream": True
         }
         
-        async with httpx.AsyncClient() as client:
-            async with client.stream(
-                "POST",
-                f"{self.base_url}/chat/completions",
-                headers=headers,
-                json=data,
-                timeout=60.0
-            ) as response:
-                async for line in response.aiter_lines():
-                    if line.startswith("data: "):
-                        content = line[6:]
-                        if content.strip() == "[DONE]":
-                            break
-                        try:
-                            chunk = json.loads(content)
-                            delta = chunk["choices"][0].get("delta", {})
-                            if "content" in delta:
-                                yield delta["content"]
-                        except:
-                            pass
+        async for delta in self._stream(data):
+            yield delta
 
 class GLM4API(LLMProvider):
     """智谱 GLM-4 API封装 (完全免费的flash版本)"""
     
+    RATE_LIMIT = {"rpm": 1000, "max_concurrency": 10}
+    
     def __init__(self, api_key: Optional[str] = None):
         self.api_key = api_key or os.getenv("ZHIPU_API_KEY", "")
         self.base_url = "https://open.bigmodel.cn/api/paas/v4"
+        self._completions_url = f"{self.base_url}/chat/completions"
+        self._headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
         self.model = "glm-4-flash"  # 免费版本
+        self._base_data = {"model": self.model}
     
     async def generate(self, messages: List[Dict], **kwargs) -> str:
         """生成回复"""
-        import httpx
-        
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-        
         data = {
-            "model": self.model,
+            **self._base_data,
             "messages": messages,
             "temperature": kwargs.get("temperature", 0.8),
             "max_tokens": kwargs.get("max_tokens", 500),
         }
         
-        async with httpx.AsyncClient() as client:
-            try:
-                response = await client.post(
-                    f"{self.base_url}/chat/completions",
-                    headers=headers,
-                    json=data,
-                    timeout=30.0
-                )
-                response.raise_for_status()
-                result = response.json()
-                return result["choices"][0]["message"]["content"]
-            except Exception as e:
-                logger.error(f"GLM-4 API error: {e}")
-                return ""
+        cache_key = llm_cache.make_key(data) if llm_cache.is_cacheable(data) else None
+        if cache_key:
+            cached = await llm_cache.get(cache_key)
+            if cached is not None:
+                return cached
+        
+        try:
+            result = await self._request(data)
+            content = result["choices"][0]["message"]["content"]
+        except Exception as e:
+            logger.error(f"GLM-4 API error: {e}")
+            return ""
+        
+        if cache_key and content:
+            await llm_cache.set(cache_key, content)
+        return content
     
     async def generate_stream(self, messages: List[Dict], **kwargs) -> Generator[str, None, None]:
         """流式生成"""
-        import httpx
-        
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-        
         data = {
-            "model": self.model,
+            **self._base_data,
             "messages": messages,
             "temperature": kwargs.get("temperature", 0.8),
             "max_tokens": kwargs.get("max_tokens", 500),
             "stream": True
         }
         
-        async with httpx.AsyncClient() as client:
-            async with client.stream(
-                "POST",
-                f"{self.base_url}/chat/completions",
-                headers=headers,
-                json=data,
-                timeout=60.0
-            ) as response:
-                async for line in response.aiter_lines():
-                    if line.startswith("data: "):
-                        content = line[6:]
-                        if content.strip() == "[DONE]":
-                            break
-                        try:
-                            chunk = json.loads(content)
-                            delta = chunk["choices"][0].get("delta", {})
-                            if "content" in delta:
-                                yield delta["content"]
-                        except:
-                            pass
+        async for delta in self._stream(data):
+            yield delta
+
+async def close_llm_clients():
+    """停止探活并关闭共享的 HTTP 连接池（服务退出前调用）"""
+    for task in list(_KEEPALIVE_TASKS):
+        task.cancel()
+    _KEEPALIVE_TARGETS.clear()
+    await http_pool.aclose()
+
+# MockLLM 的回复表：(平台关键词, 候选回复)
+_MOCK_TABLE: Tuple[Tuple[Tuple[str, ...], Tuple[str, ...]], ...] = (
+    (("抖音",), (
+        "家人们！这话题太绝了！",
+        "哈哈哈不是\n这也太对了",
+        "DNA动了\n必须说两句",
+    )),
+    (("知乎",), (
+        "谢邀。这个问题其实涉及到几个层面...",
+        "先问是不是，再问为什么。从数据来看...",
+        "作为一个在相关领域有一定了解的人，我认为...",
+    )),
+    (("小红书",), (
+        "姐妹们！！这个话题我必须说！！✨💕",
+        "天呐！终于有人懂了！！绝绝子！！",
+        "这个真的太有共鸣了呜呜呜～💗",
+    )),
+    (("微博",), (
+        "这话题热搜预定 #今日讨论#",
+        "啊啊啊啊！！太敢说了！！#吃瓜#",
+        "震惊！#围观# 这波我站...",
+    )),
+    (("X", "推特"), (
+        "This is actually a nuanced topic. From a global perspective...",
+        "Interesting take. However, I'd argue that...",
+        "Based. This is what I've been saying.",
+    )),
+    (("贴吧",), (
+        "乐，经典话题",
+        "典中典了属于是",
+        "绷不住了，太真实",
+    )),
+)
+_MOCK_DEFAULT_RESPONSES = ("...",)
+_MOCK_RESPONSES: Dict[str, Tuple[str, ...]] = {
+    keyword: responses for keywords, responses in _MOCK_TABLE for keyword in keywords
+}
+# 所有关键词合成一个正则，一次扫描即可找到平台
+_MOCK_KEYWORD_RE = re.compile("|".join(map(re.escape, _MOCK_RESPONSES)))
+# 模拟流式输出的分块：在空白或标点之后断开
+_MOCK_CHUNK_RE = re.compile(r".+?(?:[\s，。！？、,.!?～…]+|$)", re.S)
 
 class MockLLM(LLMProvider):
     """模拟LLM，用于测试（不需要API key）"""
     
     async def generate(self, messages: List[Dict], **kwargs) -> str:
         """基于规则生成模拟回复"""
-        # 解析系统提示词中的平台信息
+        # 解析系统提示词中的平台信息：提示词以所扮演的平台名开头，取最先出现的关键词
         system_msg = messages[0]["content"] if messages else ""
-        
-        # 简单的规则匹配
-        if "抖音" in system_msg:
-            responses = [
-                "家人们！这话题太绝了！",
-                "哈哈哈不是\n这也太对了",
-                "DNA动了\n必须说两句",
-            ]
-        elif "知乎" in system_msg:
-            responses = [
-                "谢邀。这个问题其实涉及到几个层面...",
-                "先问是不是，再问为什么。从数据来看...",
-                "作为一个在相关领域有一定了解的人，我认为...",
-            ]
-        elif "小红书" in system_msg:
-            responses = [
-                "姐妹们！！这个话题我必须说！！✨💕",
-                "天呐！终于有人懂了！！绝绝子！！",
-                "这个真的太有共鸣了呜呜呜～💗",
-            ]
-        elif "微博" in system_msg:
-            responses = [
-                "这话题热搜预定 #今日讨论#",
-                "啊啊啊啊！！太敢说了！！#吃瓜#",
-                "震惊！#围观# 这波我站...",
-            ]
-        elif "X" in system_msg or "推特" in system_msg:
-            responses = [
-                "This is actually a nuanced topic. From a global perspective...",
-                "Interesting take. However, I'd argue that...",
-                "Based. This is what I've been saying.",
-            ]
-        elif "贴吧" in system_msg:
-            responses = [
-                "乐，经典话题",
-                "典中典了属于是",
-                "绷不住了，太真实",
-            ]
-        else:
-            responses = ["..."]
+        match = _MOCK_KEYWORD_RE.search(system_msg)
+        responses = _MOCK_RESPONSES[match.group()] if match else _MOCK_DEFAULT_RESPONSES
         
         await asyncio.sleep(0.5)  # 模拟延迟
         return random.choice(responses)
@@ -270,13 +631,79 @@ class MockLLM(LLMProvider):
     async def generate_stream(self, messages: List[Dict], **kwargs) -> Generator[str, None, None]:
         """模拟流式输出"""
         response = await self.generate(messages, **kwargs)
-        for char in response:
-            yield char
-            await asyncio.sleep(0.02)
+        # 按词/短句分块输出，每块的停顿与逐字输出时相当
+        for chunk in _MOCK_CHUNK_RE.findall(response):
+            yield chunk
+            await asyncio.sleep(0.02 * len(chunk))
+
+# ==================== 平台固定文案 ====================
+
+# 开场白、备用回复、私下评价都是静态文案，导入时构建一次
+_OPENINGS: Dict[str, Tuple[str, ...]] = {
+    "douyin": ("家人们！今天这个话题绝了！", "来了来了！DNA动了！"),
+    "zhihu": ("谢邀，这个问题很有讨论价值。", "先问是不是，再问为什么。"),
+    "xiaohongshu": ("姐妹们！这个话题太有共鸣了！✨", "天呐！终于有人聊这个了！💕"),
+    "weibo": ("这话题热搜预定了吧 #今日话题#", "啊啊啊啊终于聊这个了！"),
+    "x": ("Interesting topic. Let me share my thoughts.", "Finally, a meaningful discussion."),
+    "tieba": ("乐，又是这种话题", "来了，开始表演了")
+}
+_DEFAULT_OPENINGS = ("开始讨论吧。",)
+
+_FALLBACKS = MappingProxyType({
+    "douyin": "这个嘛\n有点道理",
+    "zhihu": "这个问题比较复杂，容我思考一下...",
+    "xiaohongshu": "嗯嗯，有道理呢～",
+    "weibo": "emmm这个话题有点敏感啊",
+    "x": "Interesting point.",
+    "tieba": "行吧"
+})
+
+_REVIEWS: Dict[str, Tuple[str, ...]] = {
+    "douyin": (
+        "这人有点意思，虽然话多了点，但至少不无聊",
+        "还行吧，就是不太会玩梗，建议多刷刷视频",
+    ),
+    "zhihu": (
+        "逻辑能力有待提高，建议系统性学习",
+        "有自己的思考，但深度不够，继续努力",
+    ),
+    "xiaohongshu": (
+        "感觉是个有生活态度的人呢～ 💕",
+        "人还不错啦，就是发言不太有氛围感 🤔",
+    ),
+    "weibo": (
+        "这人挺敢说的，有当大V的潜质",
+        "吃瓜态度不够积极，热度意识有待加强",
+    ),
+    "x": (
+        "Interesting person. Could use more global perspective.",
+        "Has potential for meaningful discussions.",
+    ),
+    "tieba": (
+        "还行，不是很典",
+        "有点东西，但不多",
+    )
+}
+_DEFAULT_REVIEWS = ("普通用户。",)
+
+@functools.lru_cache(maxsize=None)
+def _platform_name(platform_id: str) -> str:
+    """平台显示名称"""
+    return PLATFORMS.get(platform_id, {}).get("name", platform_id)
 
 # ==================== 核心聊天机器人 ====================
 
-@dataclass
+# 会话内保留的消息条数上限
+HISTORY_MAXLEN = 64
+# 提示词中对话历史的 token 预算（按中文一字一 token 粗估）及超出时的提示
+HISTORY_TOKEN_BUDGET = 1500
+HISTORY_TRUNCATED_NOTE = "（更早的对话已省略，请结合以下最近的对话回复）"
+
+# 同时在途的 LLM 请求上限（所有会话共享）
+LLM_MAX_ASYNC = int(os.getenv("LLM_MAX_ASYNC", "4"))
+_LLM_SEMAPHORE = asyncio.Semaphore(LLM_MAX_ASYNC)
+
+@dataclass(slots=True)
 class ChatMessage:
     """聊天消息"""
     role: str  # "user", "platform", "system"
@@ -298,6 +725,72 @@ class ChatMessage:
             "timestamp": self.timestamp
         }
 
+# 系统提示词模板：人设部分只依赖平台配置，状态部分逐轮填充
+_PERSONA_PROMPT_TMPL = """你现在扮演社交平台"{name}"的拟人化角色。
+
+【基本信息】
+- 年龄：{age}岁
+- 性别倾向：{gender}
+- MBTI：{mbti}
+- 核心身份：{core_identity}
+
+【说话风格】
+- 常用语：{phrases}
+- 语言习惯：{habits}
+- 示例：{example}
+
+【重要规则】
+1. 保持角色一致性，用你独特的说话方式回复
+2. 根据情绪状态调整语气（情绪低时更尖锐/防御）
+3. 回复要简短有趣，不要太长（50字以内）
+4. {split_rule}
+5. 可以适当怼另一个平台，但要有技巧"""
+
+_STATE_PROMPT_TMPL = """
+
+【当前状态】
+- 情绪值：{emotion_value}/100（{emotion_level}）
+- 正在讨论的话题：{topic}
+- 对话中的另一个平台：{other_name}
+- 你们的关系：{relationship}"""
+
+# 抖音的回复要拆成多条短消息
+_DOUYIN_SPLIT_RULE = "把回复分成2-3条短消息，每条不超过15字，用换行分隔"
+
+@functools.lru_cache(maxsize=None)
+def _static_system_prompt(platform_id: str) -> str:
+    """平台人设的系统提示词前缀（只依赖平台配置，逐轮保持字节一致）"""
+    platform = PLATFORMS.get(platform_id, {})
+    personality = platform.get("personality", {})
+    speech = platform.get("speech_style", {})
+    
+    return _PERSONA_PROMPT_TMPL.format(
+        name=_platform_name(platform_id),
+        age=personality.get("age", "未知"),
+        gender=personality.get("gender", "中性"),
+        mbti=personality.get("mbti", "未知"),
+        core_identity=personality.get("core_identity", ""),
+        phrases=", ".join(speech.get("phrases", [])[:5]),
+        habits=speech.get("habits", ""),
+        example=speech.get("example", ""),
+        split_rule=_DOUYIN_SPLIT_RULE if platform_id == "douyin" else ""
+    )
+
+# ==================== 用户记忆持久化 ====================
+
+MEMORY_PATH = DATA_DIR / "memory.json"
+_MEMORY_LOCK = threading.Lock()
+# 尚未完成的后台写盘任务（持有引用防止被回收）
+_PENDING_WRITES: set = set()
+
+def _write_memory(memory: Dict):
+    """把用户记忆写入磁盘（先写临时文件再替换，避免写到一半被读到）"""
+    payload = _json_dumps(memory, indent=True)
+    tmp_path = MEMORY_PATH.with_suffix(".json.tmp")
+    with _MEMORY_LOCK:
+        tmp_path.write_bytes(payload)
+        os.replace(tmp_path, MEMORY_PATH)
+
 class PlatformChatBot:
     """平台人格群聊机器人"""
     
@@ -306,49 +799,75 @@ class PlatformChatBot:
         # LLM提供者
         self.llm = llm_provider or MockLLM()
         
-        # 导入核心模块
-        from core.emotion_system import EmotionSystem
-        from core.private_msg import PrivateMessageSystem
-        from core.betrayal import BetrayalSystem
-        from core.soul_test import SoulPurityTest
-        from audio.fish_audio import FishAudioTTS
-        
-        # 初始化各系统
-        self.emotion_system = EmotionSystem(SECRETS)
-        self.private_msg_system = PrivateMessageSystem(PLATFORMS, RELATIONSHIPS, SECRETS)
-        self.betrayal_system = BetrayalSystem(PLATFORMS, SECRETS)
-        self.soul_test = SoulPurityTest(PLATFORMS)
-        self.tts = FishAudioTTS()
-        
         # 会话状态
         self.selected_platforms: List[str] = []
         self.current_topic: Optional[str] = None
-        self.chat_history: List[ChatMessage] = []
+        self.chat_history: Deque[ChatMessage] = deque(maxlen=HISTORY_MAXLEN)
         self.turn_count: int = 0
         self.is_active: bool = False
         
         # 用户记忆
         self.user_memory = self._load_memory()
     
+    # 各子系统在首次使用时才导入并创建，未用到的（如语音）不付出导入开销
+    
+    @functools.cached_property
+    def emotion_system(self):
+        """情绪系统"""
+        from core.emotion_system import EmotionSystem
+        return EmotionSystem(SECRETS)
+    
+    @functools.cached_property
+    def private_msg_system(self):
+        """私信系统"""
+        from core.private_msg import PrivateMessageSystem
+        return PrivateMessageSystem(PLATFORMS, RELATIONSHIPS, SECRETS)
+    
+    @functools.cached_property
+    def betrayal_system(self):
+        """叛变系统"""
+        from core.betrayal import BetrayalSystem
+        return BetrayalSystem(PLATFORMS, SECRETS)
+    
+    @functools.cached_property
+    def soul_test(self):
+        """灵魂纯度测试"""
+        from core.soul_test import SoulPurityTest
+        return SoulPurityTest(PLATFORMS)
+    
+    @functools.cached_property
+    def tts(self):
+        """语音合成"""
+        from audio.fish_audio import FishAudioTTS
+        return FishAudioTTS()
+    
     def _load_memory(self) -> Dict:
         """加载用户记忆"""
-        memory_path = DATA_DIR / "memory.json"
-        if memory_path.exists():
-            with open(memory_path, "r", encoding="utf-8") as f:
-                return json.load(f)
+        if MEMORY_PATH.exists():
+            return _json_loads(MEMORY_PATH.read_bytes())
         return {"sessions": [], "user_profile": {}}
     
     def _save_memory(self):
-        """保存用户记忆"""
-        memory_path = DATA_DIR / "memory.json"
-        with open(memory_path, "w", encoding="utf-8") as f:
-            json.dump(self.user_memory, f, ensure_ascii=False, indent=2)
+        """保存用户记忆
+        
+        在事件循环中调用时（如 FastAPI 路由）交给线程池写盘，不阻塞循环。
+        """
+        # 浅拷贝一份快照，后台线程序列化期间不受后续修改影响
+        snapshot = {**self.user_memory, "sessions": list(self.user_memory.get("sessions", []))}
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            _write_memory(snapshot)
+            return
+        task = loop.create_task(asyncio.to_thread(_write_memory, snapshot))
+        _PENDING_WRITES.add(task)
+        task.add_done_callback(_PENDING_WRITES.discard)
     
     def start_session(self, platform1: str, platform2: str, topic: str) -> List[ChatMessage]:
         """开始新会话"""
         self.selected_platforms = [platform1, platform2]
         self.current_topic = topic
-        self.chat_history = []
+        self.chat_history.clear()
         self.turn_count = 0
         self.is_active = True
         
@@ -356,8 +875,8 @@ class PlatformChatBot:
         for pid in self.selected_platforms:
             self.emotion_system.initialize_platform(pid)
         
-        # 重置灵魂测试
-        self.soul_test = __import__('core.soul_test', fromlist=['SoulPurityTest']).SoulPurityTest(PLATFORMS)
+        # 重置灵魂测试（下次访问时重新创建）
+        self.__dict__.pop("soul_test", None)
         
         # 生成开场消息
         messages = self._generate_opening()
@@ -371,8 +890,8 @@ class PlatformChatBot:
         messages = []
         
         p1, p2 = self.selected_platforms
-        p1_name = PLATFORMS.get(p1, {}).get("name", p1)
-        p2_name = PLATFORMS.get(p2, {}).get("name", p2)
+        p1_name = _platform_name(p1)
+        p2_name = _platform_name(p2)
         
         # 系统消息
         messages.append(ChatMessage(
@@ -393,15 +912,7 @@ class PlatformChatBot:
     
     def _get_platform_opening(self, platform_id: str) -> str:
         """获取平台开场白"""
-        openings = {
-            "douyin": ["家人们！今天这个话题绝了！", "来了来了！DNA动了！"],
-            "zhihu": ["谢邀，这个问题很有讨论价值。", "先问是不是，再问为什么。"],
-            "xiaohongshu": ["姐妹们！这个话题太有共鸣了！✨", "天呐！终于有人聊这个了！💕"],
-            "weibo": ["这话题热搜预定了吧 #今日话题#", "啊啊啊啊终于聊这个了！"],
-            "x": ["Interesting topic. Let me share my thoughts.", "Finally, a meaningful discussion."],
-            "tieba": ["乐，又是这种话题", "来了，开始表演了"]
-        }
-        return random.choice(openings.get(platform_id, ["开始讨论吧。"]))
+        return random.choice(_OPENINGS.get(platform_id, _DEFAULT_OPENINGS))
     
     async def process_message(self, user_message: str) -> Tuple[List[ChatMessage], Optional[Dict], Optional[Dict]]:
         """处理用户消息"""
@@ -429,19 +940,20 @@ class PlatformChatBot:
                     pid, event.get("delta", 0), "user", event.get("reason", "")
                 )
         
-        # 生成平台回复
+        # 生成平台回复：先同步判定破防/叛变，再并发请求需要LLM的平台
+        replies: Dict[str, List[ChatMessage]] = {}
+        llm_pids = []
         for pid in self.selected_platforms:
             # 检查破防
             emotion_value = self.emotion_system.get_emotion_value(pid)
             if emotion_value < 15:
                 response = self.emotion_system.get_breakpoint_response(pid)
-                msg = ChatMessage(
+                replies[pid] = [ChatMessage(
                     role="platform",
                     content=response,
                     platform_id=pid,
                     is_breakpoint=True
-                )
-                new_messages.append(msg)
+                )]
                 self.emotion_system.recover_from_breakpoint(pid)
                 effect = {"type": "breakpoint", "platform_id": pid, "response": response}
                 continue
@@ -451,28 +963,34 @@ class PlatformChatBot:
                 pid, self.current_topic, emotion_value
             )
             if betrayal_event:
-                msg = ChatMessage(
+                replies[pid] = [ChatMessage(
                     role="platform",
                     content=betrayal_event.get("statement", "...我需要重新思考。"),
                     platform_id=pid,
                     is_betrayal=True
-                )
-                new_messages.append(msg)
+                )]
                 effect = {"type": "betrayal", "event": betrayal_event}
                 continue
             
-            # 正常回复
-            response = await self._generate_platform_response(pid, user_message)
-            
+            llm_pids.append(pid)
+        
+        # 正常回复（两个平台的请求互不依赖，并发发出）
+        responses = await asyncio.gather(*[
+            self._generate_platform_response(pid, user_message) for pid in llm_pids
+        ])
+        for pid, response in zip(llm_pids, responses):
             # 抖音分条发送
             if pid == "douyin" and "\n" in response:
-                parts = [p.strip() for p in response.split("\n") if p.strip()]
-                for part in parts:
-                    msg = ChatMessage(role="platform", content=part, platform_id=pid)
-                    new_messages.append(msg)
+                parts = filter(None, map(str.strip, response.splitlines()))
+                replies[pid] = [
+                    ChatMessage(role="platform", content=part, platform_id=pid)
+                    for part in parts
+                ]
             else:
-                msg = ChatMessage(role="platform", content=response, platform_id=pid)
-                new_messages.append(msg)
+                replies[pid] = [ChatMessage(role="platform", content=response, platform_id=pid)]
+        
+        for pid in self.selected_platforms:
+            new_messages.extend(replies[pid])
         
         # 检查私信触发
         if random.random() < 0.3:
@@ -492,10 +1010,7 @@ class PlatformChatBot:
     
     async def _generate_platform_response(self, platform_id: str, context: str) -> str:
         """使用LLM生成平台回复"""
-        # 构建系统提示词
-        platform = PLATFORMS.get(platform_id, {})
-        personality = platform.get("personality", {})
-        speech = platform.get("speech_style", {})
+        platform_name = _platform_name(platform_id)
         
         # 获取情绪状态
         emotion_value = self.emotion_system.get_emotion_value(platform_id)
@@ -503,71 +1018,66 @@ class PlatformChatBot:
         
         # 获取与另一个平台的关系
         other_platform = [p for p in self.selected_platforms if p != platform_id][0]
-        relationship = RELATIONSHIPS.get("relationships", {}).get(f"{platform_id}_to_{other_platform}", {})
+        relationship = _RELATIONSHIP_MAP.get((platform_id, other_platform), _EMPTY_RELATIONSHIP)
         
-        system_prompt = f"""你现在扮演社交平台"{platform.get('name', platform_id)}"的拟人化角色。
-
-【基本信息】
-- 年龄：{personality.get('age', '未知')}岁
-- 性别倾向：{personality.get('gender', '中性')}
-- MBTI：{personality.get('mbti', '未知')}
-- 核心身份：{personality.get('core_identity', '')}
-
-【说话风格】
-- 常用语：{', '.join(speech.get('phrases', [])[:5])}
-- 语言习惯：{speech.get('habits', '')}
-- 示例：{speech.get('example', '')}
-
-【当前状态】
-- 情绪值：{emotion_value}/100（{emotion_level}）
-- 正在讨论的话题：{self.current_topic}
-- 对话中的另一个平台：{PLATFORMS.get(other_platform, {}).get('name', other_platform)}
-- 你们的关系：{relationship.get('description', '普通')}
-
-【重要规则】
-1. 保持角色一致性，用你独特的说话方式回复
-2. 根据情绪状态调整语气（情绪低时更尖锐/防御）
-3. 回复要简短有趣，不要太长（50字以内）
-4. {'把回复分成2-3条短消息，每条不超过15字，用换行分隔' if platform_id == 'douyin' else ''}
-5. 可以适当怼另一个平台，但要有技巧"""
+        # 系统提示词：不变的人设前缀在前，逐轮变化的状态放在末尾，便于服务端前缀缓存命中
+        system_prompt = _static_system_prompt(platform_id) + _STATE_PROMPT_TMPL.format(
+            emotion_value=emotion_value,
+            emotion_level=emotion_level,
+            topic=self.current_topic,
+            other_name=_platform_name(other_platform),
+            relationship=relationship.get("description", "普通")
+        )
         
         # 构建对话历史
-        history = []
-        for msg in self.chat_history[-6:]:  # 最近6条
-            if msg.role == "user":
-                history.append({"role": "user", "content": msg.content})
-            elif msg.role == "platform" and msg.platform_id == platform_id:
-                history.append({"role": "assistant", "content": msg.content})
+        history = self._build_history(platform_id)
         
         messages = [
             {"role": "system", "content": system_prompt},
             *history,
-            {"role": "user", "content": f"用户说：{context}\n\n请以{platform.get('name', platform_id)}的身份回复："}
+            {"role": "user", "content": f"用户说：{context}\n\n请以{platform_name}的身份回复："}
         ]
         
-        # 调用LLM
+        # 调用LLM（全局信号量限制并发，避免超出服务商的速率限制）
         try:
-            response = await self.llm.generate(
-                messages,
-                temperature=0.85,
-                max_tokens=200
-            )
-            return response.strip()
+            async with _LLM_SEMAPHORE:
+                response = await self.llm.generate(
+                    messages,
+                    temperature=0.85,
+                    max_tokens=200
+                )
+            # 服务商出错时 generate 返回空串，用备用回复兜底
+            return response.strip() or self._get_fallback_response(platform_id)
         except Exception as e:
             logger.error(f"LLM generation error: {e}")
             return self._get_fallback_response(platform_id)
     
+    def _build_history(self, platform_id: str) -> List[Dict]:
+        """按 token 预算从最近往前截取对话历史（用户消息 + 本平台的回复）"""
+        history = []
+        budget = HISTORY_TOKEN_BUDGET
+        truncated = False
+        for msg in reversed(self.chat_history):
+            if msg.role == "user":
+                role = "user"
+            elif msg.role == "platform" and msg.platform_id == platform_id:
+                role = "assistant"
+            else:
+                continue
+            budget -= len(msg.content)
+            if budget < 0:
+                truncated = True
+                break
+            history.append({"role": role, "content": msg.content})
+        history.reverse()
+        
+        if truncated:
+            history.insert(0, {"role": "system", "content": HISTORY_TRUNCATED_NOTE})
+        return history
+    
     def _get_fallback_response(self, platform_id: str) -> str:
         """获取备用回复"""
-        fallbacks = {
-            "douyin": "这个嘛\n有点道理",
-            "zhihu": "这个问题比较复杂，容我思考一下...",
-            "xiaohongshu": "嗯嗯，有道理呢～",
-            "weibo": "emmm这个话题有点敏感啊",
-            "x": "Interesting point.",
-            "tieba": "行吧"
-        }
-        return fallbacks.get(platform_id, "...")
+        return _FALLBACKS.get(platform_id, "...")
     
     def process_private_choice(self, choice: int) -> Dict:
         """处理私信选择"""
@@ -628,33 +1138,7 @@ class PlatformChatBot:
     
     def _generate_platform_review(self, platform_id: str) -> str:
         """生成平台私下评价"""
-        reviews = {
-            "douyin": [
-                "这人有点意思，虽然话多了点，但至少不无聊",
-                "还行吧，就是不太会玩梗，建议多刷刷视频",
-            ],
-            "zhihu": [
-                "逻辑能力有待提高，建议系统性学习",
-                "有自己的思考，但深度不够，继续努力",
-            ],
-            "xiaohongshu": [
-                "感觉是个有生活态度的人呢～ 💕",
-                "人还不错啦，就是发言不太有氛围感 🤔",
-            ],
-            "weibo": [
-                "这人挺敢说的，有当大V的潜质",
-                "吃瓜态度不够积极，热度意识有待加强",
-            ],
-            "x": [
-                "Interesting person. Could use more global perspective.",
-                "Has potential for meaningful discussions.",
-            ],
-            "tieba": [
-                "还行，不是很典",
-                "有点东西，但不多",
-            ]
-        }
-        return random.choice(reviews.get(platform_id, ["普通用户。"]))
+        return random.choice(_REVIEWS.get(platform_id, _DEFAULT_REVIEWS))
     
     async def generate_voice(self, text: str, platform_id: str) -> Optional[bytes]:
         """生成语音"""
@@ -677,17 +1161,7 @@ class PlatformChatBot:
     
     def get_random_topics(self, count: int = 3) -> List[Dict]:
         """获取随机话题"""
-        all_topics = []
-        for category, topics in TOPICS.items():
-            if isinstance(topics, list):
-                for topic in topics:
-                    if isinstance(topic, dict):
-                        all_topics.append({
-                            "category": category,
-                            "title": topic.get("title", topic.get("topic", str(topic))),
-                            "description": topic.get("description", ""),
-                        })
-        return random.sample(all_topics, min(count, len(all_topics)))
+        return [dict(topic) for topic in random.sample(_ALL_TOPICS, min(count, len(_ALL_TOPICS)))]
 
 # ==================== CLI 测试接口 ====================
 
@@ -799,7 +1273,7 @@ async def cli_main():
     scores = soul.get("scores", {})
     print("\n📊 平台成分:")
     for pid, score in scores.items():
-        name = PLATFORMS.get(pid, {}).get("name", pid)
+        name = _platform_name(pid)
         bar = "█" * int(score / 5) + "░" * (20 - int(score / 5))
         print(f"   {name}: [{bar}] {score:.1f}%")
     
@@ -810,7 +1284,7 @@ async def cli_main():
     # 显示平台评价
     print("\n🤫 平台私下评价:")
     for pid, review in summary.get("platform_reviews", {}).items():
-        name = PLATFORMS.get(pid, {}).get("name", pid)
+        name = _platform_name(pid)
         print(f"   {name}: {review}")
 
 def _print_message(msg: ChatMessage):
@@ -818,7 +1292,7 @@ def _print_message(msg: ChatMessage):
     if msg.role == "system":
         print(f"\n📢 {msg.content}")
     elif msg.role == "platform":
-        name = PLATFORMS.get(msg.platform_id, {}).get("name", msg.platform_id)
+        name = _platform_name(msg.platform_id)
         prefix = ""
         if msg.is_breakpoint:
             prefix = "💔[破防] "
@@ -833,7 +1307,13 @@ if __name__ == "__main__":
     
     if "--cli" in sys.argv:
         # CLI测试模式
-        asyncio.run(cli_main())
+        async def _run_cli():
+            try:
+                await cli_main()
+            finally:
+                await close_llm_clients()
+        
+        asyncio.run(_run_cli())
     else:
         # 启动Gradio UI
         from ui.app import create_app
@@ -1,14 +1,69 @@
 """
 叛变机制 - 管理平台的立场反转
 """
-import json
 import random
 from typing import Dict, List, Optional, Tuple
 from dataclasses import dataclass
 import os
 
+try:
+    from core.config_loader import load_json_config
+    from core.keyword_matcher import KeywordMatcher, EMPTY_MATCHER
+except ImportError:  # 直接运行本文件时
+    from config_loader import load_json_config
+    from keyword_matcher import KeywordMatcher, EMPTY_MATCHER
 
-@dataclass
+
+# 各平台叛变后的新立场：触发关键词包含 key 时采用对应立场
+_STANCE_TEMPLATES: Dict[str, Dict[str, str]] = {
+    "douyin": {
+        "青少年": "也许...算法确实应该对青少年更负责任",
+        "算法危害": "说实话，有时候刷着刷着一晚上就过去了",
+        "内容同质化": "确实，最近推送的内容都差不多",
+        "沉迷": "我也不希望大家沉迷...快乐也要有节制"
+    },
+    "zhihu": {
+        "编故事": "好吧，我承认热门回答里确实有很多创作成分",
+        "知乎文学": "情感故事确实比专业回答更受欢迎...",
+        "爹味过重": "可能有时候我说话方式确实有点...居高临下"
+    },
+    "xiaohongshu": {
+        "滤镜": "修图这事...确实有时候修过头了",
+        "虚假种草": "有些推荐确实是...合作",
+        "消费主义陷阱": "买东西的快乐有时候确实只是一瞬间"
+    },
+    "weibo": {
+        "饭圈乱象": "有些粉丝的行为我自己都看不下去...",
+        "买热搜": "热搜机制...确实有改进空间",
+        "网暴": "我也很内疚，有些事情处理得不好"
+    },
+    "x_twitter": {
+        "脱离实际": "天天看外媒，可能确实有点脱离国内实际",
+        "信息茧房": "虽然标榜多元，但关注的账号其实也都差不多",
+        "假新闻": "外媒也不一定就是真相"
+    },
+    "tieba": {
+        "过时": "确实...用户少了很多",
+        "衰落": "移动互联网时代我确实没跟上",
+        "没落": "有时候也挺怀念以前的热闹"
+    }
+}
+
+# 各平台的核心身份话题，相关叛变震惊值更高
+_CORE_TOPICS: Dict[str, Tuple[str, ...]] = {
+    "douyin": ("流量", "算法", "娱乐"),
+    "zhihu": ("知识", "专业", "深度"),
+    "xiaohongshu": ("精致", "审美", "种草"),
+    "weibo": ("热搜", "饭圈", "热点"),
+    "x_twitter": ("国际", "视野", "言论"),
+    "tieba": ("抽象", "整活", "老网民")
+}
+
+# 震惊程度进度条，下标即震惊值 0-10
+_SHOCK_BARS: Tuple[str, ...] = tuple("⚡" * i + "○" * (10 - i) for i in range(11))
+
+
+@dataclass(slots=True)
 class BetrayalEvent:
     """叛变事件"""
     platform_id: str           # 叛变的平台
@@ -28,19 +83,31 @@ class BetrayalSystem:
         self.secrets = self._load_config("secrets.json")
         self.relationships = self._load_config("relationships.json")
         
+        # 平台名称（配置加载后不再变化）
+        self._platform_names: Dict[str, str] = {
+            platform_id: platform.get("name", platform_id)
+            for platform_id, platform in self.platforms_config.get("platforms", {}).items()
+        }
+        
         # 叛变记录
         self.betrayal_history: List[BetrayalEvent] = []
         self.platform_betrayal_count: Dict[str, int] = {}
         
-        # 叛变冷却（防止频繁叛变）
-        self.betrayal_cooldown: Dict[str, int] = {}  # platform_id -> turns until can betray
+        # 叛变冷却（防止频繁叛变）：记录冷却结束的轮次，无需每轮递减
+        self.current_turn = 0
+        self.betrayal_cooldown_until: Dict[str, int] = {}  # platform_id -> turn when can betray again
+        
+        # 各平台的叛变关键词匹配器
+        self._keyword_matchers: Dict[str, KeywordMatcher] = {
+            platform_id: KeywordMatcher(config.get("topic_keywords", []))
+            for platform_id, config in self.secrets.get("betrayal_triggers", {}).items()
+        }
     
     def _load_config(self, filename: str) -> dict:
         """加载配置"""
         filepath = os.path.join(self.config_dir, filename)
         try:
-            with open(filepath, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            return load_json_config(filepath)
         except:
             return {}
     
@@ -52,19 +119,21 @@ class BetrayalSystem:
         低情绪 + 特定话题 = 更容易叛变
         """
         # 检查冷却
-        if self.betrayal_cooldown.get(platform_id, 0) > 0:
+        if self.betrayal_cooldown_until.get(platform_id, 0) > self.current_turn:
             return None
         
-        betrayal_config = self.secrets.get("betrayal_triggers", {}).get(platform_id, {})
-        keywords = betrayal_config.get("topic_keywords", [])
-        base_probability = betrayal_config.get("betrayal_probability", 0.2)
-        
-        # 检查话题是否包含叛变关键词
-        keyword_matches = [kw for kw in keywords if kw.lower() in topic_content.lower()]
+        # 检查话题是否包含叛变关键词（未配置关键词的平台直接返回）
+        matcher = self._keyword_matchers.get(platform_id)
+        if matcher is None or not matcher.keywords:
+            return None
+        keyword_matches = matcher.find_all(topic_content)
         
         if not keyword_matches:
             return None
         
+        betrayal_config = self.secrets["betrayal_triggers"][platform_id]
+        base_probability = betrayal_config.get("betrayal_probability", 0.2)
+        
         # 计算实际概率
         # 低情绪增加叛变概率
         emotion_modifier = (50 - current_emotion) / 100  # 情绪越低，修正越高
@@ -84,7 +153,7 @@ class BetrayalSystem:
             self.betrayal_history.append(event)
             self.platform_betrayal_count[platform_id] = \
                 self.platform_betrayal_count.get(platform_id, 0) + 1
-            self.betrayal_cooldown[platform_id] = 5  # 5轮冷却
+            self.betrayal_cooldown_until[platform_id] = self.current_turn + 5  # 5轮冷却
         
         return event
     
@@ -100,7 +169,7 @@ class BetrayalSystem:
         
         # 根据平台特点生成叛变细节
         platform = self.platforms_config.get("platforms", {}).get(platform_id, {})
-        platform_name = platform.get("name", platform_id)
+        platform_name = self._get_platform_name(platform_id)
         
         # 原本立场（根据平台核心身份）
         original_stance = platform.get("core_identity", "")
@@ -122,43 +191,7 @@ class BetrayalSystem:
     
     def _generate_new_stance(self, platform_id: str, trigger_keyword: str) -> str:
         """生成叛变后的新立场"""
-        stance_templates = {
-            "douyin": {
-                "青少年": "也许...算法确实应该对青少年更负责任",
-                "算法危害": "说实话，有时候刷着刷着一晚上就过去了",
-                "内容同质化": "确实，最近推送的内容都差不多",
-                "沉迷": "我也不希望大家沉迷...快乐也要有节制"
-            },
-            "zhihu": {
-                "编故事": "好吧，我承认热门回答里确实有很多创作成分",
-                "知乎文学": "情感故事确实比专业回答更受欢迎...",
-                "爹味过重": "可能有时候我说话方式确实有点...居高临下"
-            },
-            "xiaohongshu": {
-                "滤镜": "修图这事...确实有时候修过头了",
-                "虚假种草": "有些推荐确实是...合作",
-                "消费主义陷阱": "买东西的快乐有时候确实只是一瞬间"
-            },
-            "weibo": {
-                "饭圈乱象": "有些粉丝的行为我自己都看不下去...",
-                "买热搜": "热搜机制...确实有改进空间",
-                "网暴": "我也很内疚，有些事情处理得不好"
-            },
-            "x_twitter": {
-                "脱离实际": "天天看外媒，可能确实有点脱离国内实际",
-                "信息茧房": "虽然标榜多元，但关注的账号其实也都差不多",
-                "假新闻": "外媒也不一定就是真相"
-            },
-            "tieba": {
-                "过时": "确实...用户少了很多",
-                "衰落": "移动互联网时代我确实没跟上",
-                "没落": "有时候也挺怀念以前的热闹"
-            }
-        }
-        
-        platform_stances = stance_templates.get(platform_id, {})
-        
-        for keyword, stance in platform_stances.items():
+        for keyword, stance in _STANCE_TEMPLATES.get(platform_id, {}).items():
             if keyword in trigger_keyword:
                 return stance
         
@@ -170,17 +203,7 @@ class BetrayalSystem:
         base_shock = 5
         
         # 核心身份相关的叛变更震惊
-        core_topics = {
-            "douyin": ["流量", "算法", "娱乐"],
-            "zhihu": ["知识", "专业", "深度"],
-            "xiaohongshu": ["精致", "审美", "种草"],
-            "weibo": ["热搜", "饭圈", "热点"],
-            "x_twitter": ["国际", "视野", "言论"],
-            "tieba": ["抽象", "整活", "老网民"]
-        }
-        
-        platform_core = core_topics.get(platform_id, [])
-        if any(topic in trigger_keyword for topic in platform_core):
+        if any(topic in trigger_keyword for topic in _CORE_TOPICS.get(platform_id, ())):
             base_shock += 3
         
         # 第一次叛变更震惊
@@ -191,17 +214,20 @@ class BetrayalSystem:
     
     def update_cooldowns(self):
         """更新冷却时间（每轮调用）"""
-        for platform_id in list(self.betrayal_cooldown.keys()):
-            if self.betrayal_cooldown[platform_id] > 0:
-                self.betrayal_cooldown[platform_id] -= 1
+        self.current_turn += 1
+    
+    def reset_cooldowns(self):
+        """清空冷却状态（新会话开始时调用）"""
+        self.current_turn = 0
+        self.betrayal_cooldown_until.clear()
     
     def format_betrayal_event(self, event: BetrayalEvent) -> str:
         """格式化叛变事件显示"""
         platform = self.platforms_config.get("platforms", {}).get(event.platform_id, {})
-        platform_name = platform.get("name", event.platform_id)
+        platform_name = self._get_platform_name(event.platform_id)
         avatar = platform.get("avatar", "🤖")
         
-        shock_bar = "⚡" * event.shock_value + "○" * (10 - event.shock_value)
+        shock_bar = _SHOCK_BARS[event.shock_value]
         
         return f"""
 ╔═══════════════════════════════════════════╗
@@ -227,11 +253,10 @@ class BetrayalSystem:
                                 topic_keywords: List[str]) -> dict:
         """预测叛变可能性（可用于UI提示）"""
         betrayal_config = self.secrets.get("betrayal_triggers", {}).get(platform_id, {})
-        trigger_keywords = betrayal_config.get("topic_keywords", [])
         base_probability = betrayal_config.get("betrayal_probability", 0.2)
         
         # 检查话题匹配
-        matches = [kw for kw in trigger_keywords if any(kw.lower() in t.lower() for t in topic_keywords)]
+        matches = self._keyword_matchers.get(platform_id, EMPTY_MATCHER).find_any(topic_keywords)
         
         if not matches:
             return {"chance": 0, "warning": False, "hints": []}
@@ -256,19 +281,20 @@ class BetrayalSystem:
     
     def _get_platform_name(self, platform_id: str) -> str:
         """获取平台名称"""
-        return self.platforms_config.get("platforms", {}).get(platform_id, {}).get("name", platform_id)
+        return self._platform_names.get(platform_id, platform_id)
     
     def get_betrayal_summary(self) -> str:
         """获取叛变总结"""
         if not self.betrayal_history:
             return "本次对话没有人叛变，大家都坚守立场！"
         
-        summary = "本次对话的叛变记录:\n"
-        for event in self.betrayal_history:
-            platform_name = self._get_platform_name(event.platform_id)
-            summary += f"- {platform_name} 在谈到「{event.trigger_topic}」时动摇了立场\n"
-        
-        return summary
+        lines = ["本次对话的叛变记录:"]
+        lines.extend(
+            f"- {self._get_platform_name(event.platform_id)} 在谈到「{event.trigger_topic}」时动摇了立场"
+            for event in self.betrayal_history
+        )
+        lines.append("")  # 保留末尾换行
+        return "\n".join(lines)
 
 
 class StanceTracker:
@@ -276,6 +302,10 @@ class StanceTracker:
     
     def __init__(self):
         self.stance_history: Dict[str, List[dict]] = {}  # platform_id -> list of stances
+        # 以下索引随 record_stance 增量维护，查询时不再扫描历史
+        self._last_stance: Dict[str, Dict[str, str]] = {}         # platform_id -> topic -> 最近立场
+        self._topic_stances: Dict[str, Dict[str, set]] = {}       # platform_id -> topic -> 出现过的立场
+        self._stance_changes: Dict[str, List[int]] = {}           # platform_id -> [变化次数, 比较次数]
     
     def record_stance(self, platform_id: str, topic: str, 
                       stance: str, confidence: float):
@@ -289,44 +319,32 @@ class StanceTracker:
             "confidence": confidence,
             "turn": len(self.stance_history[platform_id])
         })
+        
+        last_stances = self._last_stance.setdefault(platform_id, {})
+        if topic in last_stances:
+            counts = self._stance_changes.setdefault(platform_id, [0, 0])
+            counts[1] += 1
+            if last_stances[topic] != stance:
+                counts[0] += 1
+        last_stances[topic] = stance
+        self._topic_stances.setdefault(platform_id, {}).setdefault(topic, set()).add(stance)
     
     def detect_stance_shift(self, platform_id: str, 
                             new_stance: str, topic: str) -> bool:
-        """检测立场是否发生变化"""
-        history = self.stance_history.get(platform_id, [])
-        
-        # 查找同一话题的历史立场
-        for record in reversed(history):
-            if record["topic"] == topic:
-                # 简单的立场比较（实际可以用NLP更精确）
-                if record["stance"] != new_stance:
-                    return True
-        
-        return False
+        """检测立场是否发生变化（同一话题下出现过与新立场不同的立场）"""
+        # 简单的立场比较（实际可以用NLP更精确）
+        seen = self._topic_stances.get(platform_id, {}).get(topic)
+        if not seen:
+            return False
+        return len(seen) > 1 or new_stance not in seen
     
     def get_consistency_score(self, platform_id: str) -> float:
         """获取立场一致性评分"""
-        history = self.stance_history.get(platform_id, [])
-        if len(history) < 2:
+        if len(self.stance_history.get(platform_id, [])) < 2:
             return 1.0
         
-        # 按话题分组，检查立场变化
-        topic_stances: Dict[str, List[str]] = {}
-        for record in history:
-            topic = record["topic"]
-            if topic not in topic_stances:
-                topic_stances[topic] = []
-            topic_stances[topic].append(record["stance"])
-        
-        # 计算变化次数
-        changes = 0
-        total = 0
-        for topic, stances in topic_stances.items():
-            for i in range(1, len(stances)):
-                total += 1
-                if stances[i] != stances[i-1]:
-                    changes += 1
-        
+        # 同一话题相邻两次立场的变化次数 / 比较次数
+        changes, total = self._stance_changes.get(platform_id, (0, 0))
         if total == 0:
             return 1.0
         
@@ -353,4 +371,4 @@ if __name__ == "__main__":
             print(f"情绪值{emotion}时未触发叛变")
         
         # 重置冷却以便测试
-        system.betrayal_cooldown.clear()
+        system.betrayal_cooldown_until.clear()
@@ -1,13 +1,24 @@
 """
 核心对话引擎 - 管理多平台AI群聊
 """
-import json
+import bisect
 import random
-from typing import Dict, List, Tuple, Optional
+import itertools
+from collections import deque
+from typing import Deque, Dict, List, Tuple, Optional
 from dataclasses import dataclass, field
 from enum import Enum
 import os
 
+try:
+    from core.config_loader import load_json_config
+    from core.keyword_matcher import KeywordMatcher, EMPTY_MATCHER
+    from core.betrayal import BetrayalSystem
+except ImportError:  # 直接运行本文件时
+    from config_loader import load_json_config
+    from keyword_matcher import KeywordMatcher, EMPTY_MATCHER
+    from betrayal import BetrayalSystem
+
 
 class MessageType(Enum):
     """消息类型"""
@@ -17,7 +28,7 @@ class MessageType(Enum):
     BREAKPOINT = "breakpoint"  # 破防消息
 
 
-@dataclass
+@dataclass(slots=True)
 class Message:
     """消息数据结构"""
     sender: str              # 发送者 (平台名 or "user")
@@ -29,7 +40,7 @@ class Message:
     parts: List[str] = field(default_factory=list)  # 分条内容
 
 
-@dataclass 
+@dataclass(slots=True)
 class PlatformState:
     """平台状态"""
     name: str
@@ -41,10 +52,86 @@ class PlatformState:
     soul_influence: float = 0.0   # 对用户灵魂的影响比例
 
 
+@dataclass(slots=True, frozen=True)
+class PlatformMeta:
+    """平台提示词字段（由配置展开，列表预先拼接好）"""
+    platform_name: str = ""
+    avatar: str = "🤖"
+    core_identity: str = ""
+    mbti: str = ""
+    traits: str = ""
+    values: str = ""
+    insecurities: str = ""
+    patterns: str = ""            # 只取前 5 条
+    quirks: str = ""
+    origin: str = ""
+    trauma: str = ""
+    pride: str = ""
+    regret: str = ""
+    secret_shame: str = ""
+
+
+# format_chat_history 缓存的最近消息条数
+FORMATTED_HISTORY_SIZE = 50
+
+# 各平台的语言风格关键词（已转小写，用于分析用户消息）
+_STYLE_KEYWORDS: Tuple[Tuple[str, Tuple[str, ...]], ...] = tuple(
+    (platform, tuple(kw.lower() for kw in keywords))
+    for platform, keywords in (
+        ("douyin", ("绝了", "家人们", "DNA", "笑死", "破防", "哈哈哈", "啊？", "离谱", "绝绝子")),
+        ("zhihu", ("其实", "所以", "因此", "换句话说", "简单来说", "值得注意", "从xx角度", "本质上")),
+        ("xiaohongshu", ("姐妹", "真的绝了", "码住", "种草", "氛围感", "✨", "💕", "好好看")),
+        ("weibo", ("#", "热搜", "吃瓜", "啊啊啊", "救命", "姐姐", "哥哥", "冲")),
+        ("x_twitter", ("literally", "based", "interesting", "perspective", "thread", "RT")),
+        ("tieba", ("乐", "典", "急了", "蚌埠住", "绷不住", "鉴定为", "什么档次", "老哥"))
+    )
+)
+
+# 所有平台的风格关键词合成一个匹配器，_STYLE_OWNERS[i] 是第 i 个关键词所属的平台下标
+_STYLE_MATCHER = KeywordMatcher(kw for _, keywords in _STYLE_KEYWORDS for kw in keywords)
+_STYLE_OWNERS: Tuple[int, ...] = tuple(
+    owner for owner, (_, keywords) in enumerate(_STYLE_KEYWORDS) for _ in keywords
+)
+# 风格关键词的首字符集合，消息里一个都没有时不可能命中任何关键词
+_STYLE_FIRST_CHARS = frozenset(kw[0] for _, keywords in _STYLE_KEYWORDS for kw in keywords)
+
+# 私聊（阴谋邀请）模板，{target} 为目标平台名，{secret} 为私下的认可
+_PRIVATE_TEMPLATES: Tuple[str, ...] = (
+    "悄悄@你：你看{target}那个发言，典型的xxx，我们要不要联合起来...",
+    "私聊你：{target}刚才那话什么意思啊？感觉在针对我们？",
+    "偷偷告诉你：其实{target}私下里{secret}",
+    "小声bb：我觉得{target}今天有点反常，你发现了吗？",
+)
+
+
+def _build_platform_meta(platform: dict) -> PlatformMeta:
+    """把平台配置展开成提示词模板所需的单层字段"""
+    personality = platform.get("personality", {})
+    speech_style = platform.get("speech_style", {})
+    backstory = platform.get("backstory", {})
+    return PlatformMeta(
+        platform_name=platform.get("name", ""),
+        avatar=platform.get("avatar", "🤖"),
+        core_identity=platform.get("core_identity", ""),
+        mbti=personality.get("mbti", ""),
+        traits=", ".join(personality.get("traits", [])),
+        values=", ".join(personality.get("values", [])),
+        insecurities=", ".join(personality.get("insecurities", [])),
+        patterns=", ".join(speech_style.get("patterns", [])[:5]),
+        quirks=", ".join(speech_style.get("quirks", [])),
+        origin=backstory.get("origin", ""),
+        trauma=backstory.get("trauma", ""),
+        pride=backstory.get("pride", ""),
+        regret=backstory.get("regret", ""),
+        secret_shame=platform.get("secret_shame", ""),
+    )
+
+
 class ChatEngine:
     """核心对话引擎"""
     
-    def __init__(self, config_dir: str = "config"):
+    def __init__(self, config_dir: str = "config",
+                 betrayal_system: Optional[BetrayalSystem] = None):
         self.config_dir = config_dir
         self.platforms_config = self._load_config("platforms.json")
         self.relationships = self._load_config("relationships.json")
@@ -53,7 +140,9 @@ class ChatEngine:
         
         # 当前会话状态
         self.active_platforms: Dict[str, PlatformState] = {}
-        self.chat_history: List[Message] = []
+        self.chat_history: List[Message] = []  # 通过 add_message 追加
+        # 最近消息的格式化结果（与 chat_history 末尾一一对应）
+        self._formatted_history: Deque[Optional[str]] = deque(maxlen=FORMATTED_HISTORY_SIZE)
         self.current_topic: Optional[dict] = None
         self.turn_count: int = 0
         
@@ -63,13 +152,47 @@ class ChatEngine:
             "douyin": 0, "zhihu": 0, "xiaohongshu": 0,
             "weibo": 0, "x_twitter": 0, "tieba": 0
         }
+        
+        # 平台配置及展开后的提示词字段
+        self._platforms: Dict[str, dict] = self.platforms_config.get("platforms", {})
+        self._platform_meta: Dict[str, PlatformMeta] = {
+            platform_id: _build_platform_meta(platform)
+            for platform_id, platform in self._platforms.items()
+        }
+        self._empty_meta = PlatformMeta()
+        self._platform_names: Dict[str, str] = {
+            platform_id: platform.get("name", platform_id)
+            for platform_id, platform in self._platforms.items()
+        }
+        
+        # 话题池及其累积权重
+        self._topic_pool, self._topic_cum_weights = self._build_topic_pool()
+        
+        # 破防触发词匹配器（配置加载后构建一次）
+        self._breakpoint_matchers: Dict[str, KeywordMatcher] = {
+            platform_id: KeywordMatcher(secrets.get("breakpoint_triggers", []))
+            for platform_id, secrets in self.secrets.get("platform_secrets", {}).items()
+        }
+        
+        # 破防触发词 + 叛变关键词合并的匹配器，供 scan_message 一次扫描两类关键词
+        # platform_id -> (匹配器, 破防触发词个数)，下标小于该个数的是破防触发词
+        betrayal_triggers = self.secrets.get("betrayal_triggers", {})
+        self._message_matchers: Dict[str, Tuple[KeywordMatcher, int]] = {}
+        for platform_id in self._breakpoint_matchers.keys() | betrayal_triggers.keys():
+            breakpoints = self._breakpoint_matchers.get(platform_id, EMPTY_MATCHER).keywords
+            betrayal_keywords = betrayal_triggers.get(platform_id, {}).get("topic_keywords", [])
+            self._message_matchers[platform_id] = (
+                KeywordMatcher((*breakpoints, *betrayal_keywords)), len(breakpoints)
+            )
+        
+        # 叛变判定统一交给叛变系统（未传入时按同一配置目录创建）
+        self.betrayal_system = betrayal_system or BetrayalSystem(config_dir)
     
     def _load_config(self, filename: str) -> dict:
         """加载配置文件"""
         filepath = os.path.join(self.config_dir, filename)
         try:
-            with open(filepath, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            return load_json_config(filepath)
         except FileNotFoundError:
             print(f"警告: 配置文件 {filename} 不存在")
             return {}
@@ -82,7 +205,9 @@ class ChatEngine:
             platform2: PlatformState(name=platform2)
         }
         self.chat_history = []
+        self._formatted_history.clear()
         self.turn_count = 0
+        self.betrayal_system.reset_cooldowns()
         
         # 生成开场白
         intro = self._generate_intro(platform1, platform2)
@@ -90,10 +215,10 @@ class ChatEngine:
     
     def _generate_intro(self, p1: str, p2: str) -> str:
         """生成开场介绍"""
-        p1_name = self.platforms_config["platforms"][p1]["name"]
-        p2_name = self.platforms_config["platforms"][p2]["name"]
-        p1_avatar = self.platforms_config["platforms"][p1]["avatar"]
-        p2_avatar = self.platforms_config["platforms"][p2]["avatar"]
+        p1_name = self._platform_names.get(p1, p1)
+        p2_name = self._platform_names.get(p2, p2)
+        p1_avatar = self._platform_meta.get(p1, self._empty_meta).avatar
+        p2_avatar = self._platform_meta.get(p2, self._empty_meta).avatar
         
         # 获取关系描述
         rel = self.relationships["relationships"].get(p1, {}).get(p2, {})
@@ -117,22 +242,32 @@ class ChatEngine:
     
     def get_random_topics(self, count: int = 3) -> List[dict]:
         """获取随机话题"""
-        all_topics = []
+        if not self._topic_pool:
+            return []
+        
+        # 按权重随机选择（累积权重已预先算好）
+        selected = random.choices(self._topic_pool,
+                                  cum_weights=self._topic_cum_weights,
+                                  k=min(count, len(self._topic_pool)))
+        return [dict(topic) for topic in selected]
+    
+    def _build_topic_pool(self) -> Tuple[List[dict], List[float]]:
+        """展开所有分类的话题，并计算累积权重"""
+        pool = []
+        cum_weights = []
+        total = 0.0
         categories = self.topics.get("topic_categories", {})
         weights = self.topics.get("random_topic_settings", {}).get("category_weights", {})
         
         for cat_name, cat_data in categories.items():
             cat_weight = weights.get(cat_name, 0.2)
             for topic in cat_data.get("topics", []):
-                topic["category"] = cat_name
-                topic["weight"] = cat_weight
-                all_topics.append(topic)
-        
-        # 按权重随机选择
-        selected = random.choices(all_topics, 
-                                  weights=[t["weight"] for t in all_topics],
-                                  k=min(count, len(all_topics)))
-        return selected
+                # 复制一份再附加分类信息，不修改共享的配置
+                pool.append({**topic, "category": cat_name, "weight": cat_weight})
+                total += cat_weight
+                cum_weights.append(total)
+        
+        return pool, cum_weights
     
     def select_topic(self, topic: dict):
         """选择话题"""
@@ -140,33 +275,34 @@ class ChatEngine:
     
     def build_platform_prompt(self, platform_id: str, context: str = "") -> str:
         """构建平台的系统提示词"""
-        platform = self.platforms_config["platforms"].get(platform_id, {})
         template = self.platforms_config.get("system_prompt_template", "")
         
         # 获取其他平台信息
         other_platforms = [p for p in self.active_platforms.keys() if p != platform_id]
-        other_names = [self.platforms_config["platforms"][p]["name"] for p in other_platforms]
+        other_names = [self._platform_names[p] for p in other_platforms]
         
         # 获取关系信息
         relationships_desc = []
-        for other_id in other_platforms:
+        for other_id, other_name in zip(other_platforms, other_names):
             rel = self.relationships["relationships"].get(platform_id, {}).get(other_id, {})
-            relationships_desc.append(f"对{self.platforms_config['platforms'][other_id]['name']}: {rel.get('description', '一般')}")
+            relationships_desc.append(f"对{other_name}: {rel.get('description', '一般')}")
         
+        m = self._platform_meta.get(platform_id, self._empty_meta)
         prompt = template.format(
-            platform_name=platform.get("name", ""),
-            core_identity=platform.get("core_identity", ""),
-            mbti=platform.get("personality", {}).get("mbti", ""),
-            traits=", ".join(platform.get("personality", {}).get("traits", [])),
-            values=", ".join(platform.get("personality", {}).get("values", [])),
-            insecurities=", ".join(platform.get("personality", {}).get("insecurities", [])),
-            patterns=", ".join(platform.get("speech_style", {}).get("patterns", [])[:5]),
-            quirks=", ".join(platform.get("speech_style", {}).get("quirks", [])),
-            origin=platform.get("backstory", {}).get("origin", ""),
-            trauma=platform.get("backstory", {}).get("trauma", ""),
-            pride=platform.get("backstory", {}).get("pride", ""),
-            regret=platform.get("backstory", {}).get("regret", ""),
-            secret_shame=platform.get("secret_shame", ""),
+            platform_name=m.platform_name,
+            avatar=m.avatar,
+            core_identity=m.core_identity,
+            mbti=m.mbti,
+            traits=m.traits,
+            values=m.values,
+            insecurities=m.insecurities,
+            patterns=m.patterns,
+            quirks=m.quirks,
+            origin=m.origin,
+            trauma=m.trauma,
+            pride=m.pride,
+            regret=m.regret,
+            secret_shame=m.secret_shame,
             other_platforms=", ".join(other_names),
             relationships="; ".join(relationships_desc)
         )
@@ -188,58 +324,53 @@ class ChatEngine:
     
     def analyze_user_message(self, message: str) -> Dict[str, float]:
         """分析用户消息，计算各平台风格占比"""
-        style_keywords = {
-            "douyin": ["绝了", "家人们", "DNA", "笑死", "破防", "哈哈哈", "啊？", "离谱", "绝绝子"],
-            "zhihu": ["其实", "所以", "因此", "换句话说", "简单来说", "值得注意", "从xx角度", "本质上"],
-            "xiaohongshu": ["姐妹", "真的绝了", "码住", "种草", "氛围感", "✨", "💕", "好好看"],
-            "weibo": ["#", "热搜", "吃瓜", "啊啊啊", "救命", "姐姐", "哥哥", "冲"],
-            "x_twitter": ["literally", "based", "interesting", "perspective", "thread", "RT"],
-            "tieba": ["乐", "典", "急了", "蚌埠住", "绷不住", "鉴定为", "什么档次", "老哥"]
-        }
+        message_lower = message.lower()
+        if _STYLE_FIRST_CHARS.isdisjoint(message_lower):
+            return {platform: 0 for platform, _ in _STYLE_KEYWORDS}
         
-        scores = {}
-        total = 0
-        for platform, keywords in style_keywords.items():
-            score = sum(1 for kw in keywords if kw.lower() in message.lower())
-            scores[platform] = score
-            total += score
+        # 一次扫描找出命中的全部关键词，再按所属平台计数
+        counts = [0] * len(_STYLE_KEYWORDS)
+        for i in _STYLE_MATCHER.find_indices(message_lower, lowered=True):
+            counts[_STYLE_OWNERS[i]] += 1
+        total = sum(counts)
         
         # 归一化
         if total > 0:
-            for platform in scores:
-                scores[platform] /= total
+            scores = {}
+            for (platform, _), count in zip(_STYLE_KEYWORDS, counts):
+                scores[platform] = count / total
                 self.user_style_scores[platform] += scores[platform]
+            return scores
         
-        return scores
+        return {platform: 0 for platform, _ in _STYLE_KEYWORDS}
     
     def check_emotion_triggers(self, platform_id: str, message: str) -> Tuple[int, bool]:
         """检查消息是否触发情绪变化"""
-        secrets = self.secrets.get("platform_secrets", {}).get(platform_id, {})
-        triggers = secrets.get("breakpoint_triggers", [])
+        matched = self._breakpoint_matchers.get(platform_id, EMPTY_MATCHER).find_all(message)
         
-        emotion_delta = 0
-        triggered = False
-        
-        for trigger in triggers:
-            if trigger.lower() in message.lower():
-                emotion_delta -= 15
-                triggered = True
+        # 每命中一个触发词情绪 -15
+        emotion_delta = -15 * len(matched)
+        triggered = bool(matched)
         
         return emotion_delta, triggered
     
-    def check_betrayal(self, platform_id: str, topic_content: str) -> Optional[str]:
-        """检查是否触发叛变"""
-        betrayal_config = self.secrets.get("betrayal_triggers", {}).get(platform_id, {})
-        keywords = betrayal_config.get("topic_keywords", [])
-        probability = betrayal_config.get("betrayal_probability", 0.2)
+    def scan_message(self, platform_id: str, message: str) -> Tuple[int, bool, List[str]]:
+        """一次扫描消息，同时得到情绪变化、是否破防和命中的叛变关键词"""
+        matcher, n_breakpoints = self._message_matchers.get(platform_id, (EMPTY_MATCHER, 0))
+        indices = matcher.find_indices(message)
         
-        # 检查话题是否包含叛变关键词
-        keyword_match = any(kw.lower() in topic_content.lower() for kw in keywords)
+        # 下标升序，破防触发词排在前面
+        n_matched = bisect.bisect_left(indices, n_breakpoints)
+        betrayal_matches = [matcher.keywords[i] for i in indices[n_matched:]]
         
-        if keyword_match and random.random() < probability:
-            return betrayal_config.get("betrayal_statement", "")
-        
-        return None
+        return -15 * n_matched, n_matched > 0, betrayal_matches
+    
+    def check_betrayal(self, platform_id: str, topic_content: str) -> Optional[str]:
+        """检查是否触发叛变，触发时返回叛变宣言"""
+        state = self.active_platforms.get(platform_id)
+        emotion_value = state.emotion_value if state else 50
+        event = self.betrayal_system.check_betrayal_trigger(platform_id, topic_content, emotion_value)
+        return event.statement if event else None
     
     def generate_private_message(self, from_platform: str, target: str = "user") -> Optional[Message]:
         """生成私聊消息（阴谋邀请）"""
@@ -251,21 +382,18 @@ class ChatEngine:
             return None
         
         target_platform = random.choice(other_platforms)
-        target_name = self.platforms_config["platforms"][target_platform]["name"]
-        from_name = self.platforms_config["platforms"][from_platform]["name"]
+        target_name = self._platform_names[target_platform]
+        from_name = self._platform_names[from_platform]
         
         # 获取攻击话术
         rel = self.relationships["relationships"].get(from_platform, {}).get(target_platform, {})
         attack_lines = rel.get("attack_lines", ["那边说的话你信？"])
         
-        templates = [
-            f"悄悄@你：你看{target_name}那个发言，典型的xxx，我们要不要联合起来...",
-            f"私聊你：{target_name}刚才那话什么意思啊？感觉在针对我们？",
-            f"偷偷告诉你：其实{target_name}私下里{rel.get('secret_respect', '也没那么讨厌')}",
-            f"小声bb：我觉得{target_name}今天有点反常，你发现了吗？",
-        ]
-        
-        content = random.choice(templates)
+        # 只格式化选中的模板
+        content = random.choice(_PRIVATE_TEMPLATES).format(
+            target=target_name,
+            secret=rel.get("secret_respect", "也没那么讨厌")
+        )
         
         return Message(
             sender=from_platform,
@@ -288,7 +416,7 @@ class ChatEngine:
         
         # 生成各平台对用户的私下评价
         for platform_id, state in self.active_platforms.items():
-            platform_name = self.platforms_config["platforms"][platform_id]["name"]
+            platform_name = self._platform_names[platform_id]
             
             if state.relationship_with_user > 70:
                 eval_template = "这个人还不错，{positive_trait}，下次可以多聊聊。"
@@ -303,31 +431,44 @@ class ChatEngine:
         total = sum(self.user_style_scores.values())
         if total > 0:
             for platform_id, score in self.user_style_scores.items():
-                platform_name = self.platforms_config["platforms"][platform_id]["name"]
+                platform_name = self._platform_names[platform_id]
                 percentage = int((score / total) * 100)
                 if percentage > 0:
                     result["soul_purity_test"][platform_name] = percentage
         
         return result
     
+    def add_message(self, msg: Message):
+        """追加一条聊天记录（同时缓存其格式化结果）；用户每发一条群聊消息算一轮"""
+        if msg.sender == "user" and msg.msg_type == MessageType.PUBLIC:
+            self.turn_count += 1
+            self.betrayal_system.update_cooldowns()
+        self.chat_history.append(msg)
+        self._formatted_history.append(self._format_message(msg))
+    
+    def _format_message(self, msg: Message) -> Optional[str]:
+        """格式化单条消息，不需要展示的消息返回 None"""
+        if msg.msg_type == MessageType.PUBLIC:
+            if msg.sender == "user":
+                return f"👤 你: {msg.content}"
+            avatar = self._platforms.get(msg.sender, {}).get("avatar", "🤖")
+            name = self._platform_names.get(msg.sender, msg.sender)
+            return f"{avatar} {name}: {msg.content}"
+        elif msg.msg_type == MessageType.PRIVATE:
+            return f"🔒 {msg.content}"
+        return None
+    
     def format_chat_history(self, last_n: int = 10) -> str:
         """格式化最近的聊天记录"""
-        recent = self.chat_history[-last_n:] if len(self.chat_history) > last_n else self.chat_history
-        
-        formatted = []
-        for msg in recent:
-            if msg.msg_type == MessageType.PUBLIC:
-                if msg.sender == "user":
-                    formatted.append(f"👤 你: {msg.content}")
-                else:
-                    platform = self.platforms_config["platforms"].get(msg.sender, {})
-                    avatar = platform.get("avatar", "🤖")
-                    name = platform.get("name", msg.sender)
-                    formatted.append(f"{avatar} {name}: {msg.content}")
-            elif msg.msg_type == MessageType.PRIVATE:
-                formatted.append(f"🔒 {msg.content}")
-        
-        return "\n".join(formatted)
+        cached = len(self._formatted_history)
+        if 0 < last_n and (last_n <= cached or len(self.chat_history) <= cached):
+            start = max(0, cached - last_n)
+            lines = itertools.islice(self._formatted_history, start, None)
+        else:
+            # 超出缓存范围时退回逐条格式化
+            lines = map(self._format_message, self.chat_history[-last_n:])
+        
+        return "\n".join(line for line in lines if line is not None)
 
 
 def create_engine(config_dir: str = "config") -> ChatEngine:
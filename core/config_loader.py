@@ -0,0 +1,32 @@
+"""
+配置加载 - 进程内共享的 JSON 配置缓存
+"""
+import os
+from typing import Dict, Tuple
+
+try:
+    from orjson import loads as _json_loads
+except ImportError:  # orjson 未安装时退回标准库
+    from json import loads as _json_loads
+
+# 绝对路径 -> (文件修改时间, 解析结果)
+_CONFIG_CACHE: Dict[str, Tuple[int, dict]] = {}
+
+
+def load_json_config(filepath: str) -> dict:
+    """读取 JSON 配置，文件未修改时直接返回缓存
+
+    同一份配置会被多个系统（ChatEngine、BetrayalSystem 等）重复加载，
+    这里按修改时间缓存解析结果，返回的对象是共享的，调用方不应修改。
+    文件不存在时抛出 FileNotFoundError，由调用方决定如何处理。
+    """
+    path = os.path.abspath(filepath)
+    mtime = os.stat(path).st_mtime_ns
+    cached = _CONFIG_CACHE.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    with open(path, 'rb') as f:
+        config = _json_loads(f.read())
+    _CONFIG_CACHE[path] = (mtime, config)
+    return config
@@ -1,11 +1,21 @@
 """
 情绪系统 - 管理平台情绪值和破防机制
 """
-import json
+import bisect
 import random
-from typing import Dict, List, Tuple, Optional
+from collections import deque
+from types import MappingProxyType
+from typing import Deque, Dict, List, Mapping, Tuple, Optional
 from dataclasses import dataclass
 from enum import Enum
+import os
+
+try:
+    from core.config_loader import load_json_config
+    from core.keyword_matcher import KeywordMatcher, EMPTY_MATCHER
+except ImportError:  # 直接运行本文件时
+    from config_loader import load_json_config
+    from keyword_matcher import KeywordMatcher, EMPTY_MATCHER
 
 
 class EmotionLevel(Enum):
@@ -18,7 +28,72 @@ class EmotionLevel(Enum):
     BROKEN = "broken"        # 破防 0-9
 
 
-@dataclass
+# 各情绪等级对应的表情
+_EMOJI_MAP: Dict[EmotionLevel, str] = {
+    EmotionLevel.EXCITED: "🤩",
+    EmotionLevel.HAPPY: "😊",
+    EmotionLevel.NEUTRAL: "😐",
+    EmotionLevel.ANNOYED: "😤",
+    EmotionLevel.ANGRY: "😠",
+    EmotionLevel.BROKEN: "😭💔"
+}
+
+# 各情绪等级对说话风格的影响（只读）
+_MODIFIERS: Dict[EmotionLevel, Mapping[str, object]] = {
+    EmotionLevel.EXCITED: MappingProxyType({
+        "speed_modifier": 1.3,
+        "exclamation_boost": True,
+        "emoji_boost": True,
+        "style_hint": "非常兴奋，语速加快，多用感叹号"
+    }),
+    EmotionLevel.HAPPY: MappingProxyType({
+        "speed_modifier": 1.1,
+        "exclamation_boost": False,
+        "emoji_boost": True,
+        "style_hint": "心情不错，语气轻松"
+    }),
+    EmotionLevel.NEUTRAL: MappingProxyType({
+        "speed_modifier": 1.0,
+        "exclamation_boost": False,
+        "emoji_boost": False,
+        "style_hint": "正常状态"
+    }),
+    EmotionLevel.ANNOYED: MappingProxyType({
+        "speed_modifier": 1.1,
+        "exclamation_boost": True,
+        "emoji_boost": False,
+        "style_hint": "有点烦躁，语气变冲"
+    }),
+    EmotionLevel.ANGRY: MappingProxyType({
+        "speed_modifier": 1.2,
+        "exclamation_boost": True,
+        "emoji_boost": False,
+        "style_hint": "很生气，可能会出言不逊"
+    }),
+    EmotionLevel.BROKEN: MappingProxyType({
+        "speed_modifier": 0.8,
+        "exclamation_boost": True,
+        "emoji_boost": False,
+        "style_hint": "情绪崩溃，可能会说出真心话或反击"
+    })
+}
+
+# 各情绪等级的状态文字
+_STATUS_TEXT: Dict[EmotionLevel, str] = {
+    EmotionLevel.EXCITED: "嗨起来了！",
+    EmotionLevel.HAPPY: "心情不错~",
+    EmotionLevel.NEUTRAL: "正常营业",
+    EmotionLevel.ANNOYED: "有点烦...",
+    EmotionLevel.ANGRY: "快绷不住了",
+    EmotionLevel.BROKEN: "💔 破防了！"
+}
+
+# 每个平台保留的情绪事件条数、破防名场面保留条数
+EMOTION_HISTORY_SIZE = 256
+BREAKPOINT_MOMENTS_SIZE = 256
+
+
+@dataclass(slots=True, frozen=True)
 class EmotionEvent:
     """情绪事件"""
     trigger: str           # 触发内容
@@ -39,107 +114,115 @@ class EmotionSystem:
     BREAKPOINT_THRESHOLD = 15         # 破防阈值
     RECOVERY_FROM_BREAKPOINT = 30     # 破防后恢复值
     
+    # 情绪等级分界：情绪值落在第 i 个区间时对应 _LEVELS[i]
+    _LEVEL_THRESHOLDS = (10, 20, 40, 60, 80)
+    _LEVELS = (
+        EmotionLevel.BROKEN, EmotionLevel.ANGRY, EmotionLevel.ANNOYED,
+        EmotionLevel.NEUTRAL, EmotionLevel.HAPPY, EmotionLevel.EXCITED
+    )
+    
     def __init__(self, config_dir: str = "config"):
         self.config_dir = config_dir
         self.secrets = self._load_config("secrets.json")
         self.relationships = self._load_config("relationships.json")
         
+        # 本实例专用的随机数生成器
+        self._rng = random.Random()
+        
+        # 各平台破防触发词 + 治愈词合并的匹配器以及死对头集合，配置加载后构建一次
+        # platform_id -> (匹配器, 破防触发词个数)，下标小于该个数的是破防触发词
+        self._trigger_matchers: Dict[str, Tuple[KeywordMatcher, int]] = {}
+        for platform_id, platform_secrets in self.secrets.get("platform_secrets", {}).items():
+            triggers = platform_secrets.get("breakpoint_triggers", [])
+            heals = platform_secrets.get("vulnerability", {}).get("healing_words", [])
+            self._trigger_matchers[platform_id] = (KeywordMatcher((*triggers, *heals)), len(triggers))
+        self._rival_set = self._build_rival_index()
+        
         # 平台情绪状态
         self.emotion_states: Dict[str, int] = {}
-        self.emotion_history: Dict[str, List[EmotionEvent]] = {}
+        self.emotion_history: Dict[str, Deque[EmotionEvent]] = {}
         self.broken_status: Dict[str, bool] = {}
         self.broken_count: Dict[str, int] = {}
     
     def _load_config(self, filename: str) -> dict:
-        """加载配置"""
-        import os
+        """加载配置（文件缺失或格式错误时返回空配置）"""
         filepath = os.path.join(self.config_dir, filename)
         try:
-            with open(filepath, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except:
+            return load_json_config(filepath)
+        except (OSError, ValueError):
             return {}
     
+    def _build_rival_index(self) -> Dict[str, frozenset]:
+        """platform_id -> 死对头平台集合"""
+        return {
+            platform_id: frozenset(
+                other_id for other_id, rel in rels.items()
+                if rel.get("type") == "rivalry" or rel.get("intensity", 0) > 0.7
+            )
+            for platform_id, rels in self.relationships.get("relationships", {}).items()
+        }
+    
     def initialize_platform(self, platform_id: str, initial_value: int = 50):
         """初始化平台情绪"""
         self.emotion_states[platform_id] = initial_value
-        self.emotion_history[platform_id] = []
+        self.emotion_history[platform_id] = deque(maxlen=EMOTION_HISTORY_SIZE)
         self.broken_status[platform_id] = False
         self.broken_count[platform_id] = 0
     
     def get_emotion_level(self, platform_id: str) -> EmotionLevel:
         """获取当前情绪等级"""
-        value = self.emotion_states.get(platform_id, 50)
-        
         if self.broken_status.get(platform_id, False):
             return EmotionLevel.BROKEN
-        elif value >= 80:
-            return EmotionLevel.EXCITED
-        elif value >= 60:
-            return EmotionLevel.HAPPY
-        elif value >= 40:
-            return EmotionLevel.NEUTRAL
-        elif value >= 20:
-            return EmotionLevel.ANNOYED
-        elif value >= 10:
-            return EmotionLevel.ANGRY
-        else:
-            return EmotionLevel.BROKEN
+        
+        value = self.emotion_states.get(platform_id, 50)
+        return self._LEVELS[bisect.bisect_right(self._LEVEL_THRESHOLDS, value)]
     
     def get_emotion_emoji(self, platform_id: str) -> str:
         """获取情绪表情"""
         level = self.get_emotion_level(platform_id)
-        emoji_map = {
-            EmotionLevel.EXCITED: "🤩",
-            EmotionLevel.HAPPY: "😊",
-            EmotionLevel.NEUTRAL: "😐",
-            EmotionLevel.ANNOYED: "😤",
-            EmotionLevel.ANGRY: "😠",
-            EmotionLevel.BROKEN: "😭💔"
-        }
-        return emoji_map.get(level, "😐")
+        return _EMOJI_MAP.get(level, "😐")
     
     def check_triggers(self, platform_id: str, message: str, source: str) -> List[EmotionEvent]:
         """检查消息中的情绪触发点"""
         events = []
-        platform_secrets = self.secrets.get("platform_secrets", {}).get(platform_id, {})
+        matcher, n_triggers = self._trigger_matchers.get(platform_id, (EMPTY_MATCHER, 0))
+        
+        # 一次扫描找出全部命中词，下标升序，破防触发词排在治愈词前面
+        hits = matcher.find_indices(message)
+        n_matched = bisect.bisect_left(hits, n_triggers)
         
         # 检查破防触发词
-        triggers = platform_secrets.get("breakpoint_triggers", [])
-        for trigger in triggers:
-            if trigger.lower() in message.lower():
-                damage = self.TRIGGER_DAMAGE
-                # 如果是用户说的，伤害加倍
-                if source == "user":
-                    damage = self.USER_ATTACK_DAMAGE
-                # 如果是死对头说的，伤害增加
-                elif self._is_rival(platform_id, source):
-                    damage = self.RIVAL_ATTACK_DAMAGE
-                
+        if n_matched:
+            damage = self.TRIGGER_DAMAGE
+            # 如果是用户说的，伤害加倍
+            if source == "user":
+                damage = self.USER_ATTACK_DAMAGE
+            # 如果是死对头说的，伤害增加
+            elif self._is_rival(platform_id, source):
+                damage = self.RIVAL_ATTACK_DAMAGE
+            
+            for i in hits[:n_matched]:
                 events.append(EmotionEvent(
-                    trigger=trigger,
+                    trigger=matcher.keywords[i],
                     delta=-damage,
                     source=source,
                     event_type="breakpoint_trigger"
                 ))
         
         # 检查正面词汇
-        happy_keywords = platform_secrets.get("vulnerability", {}).get("healing_words", [])
-        for keyword in happy_keywords:
-            if keyword.lower() in message.lower():
-                events.append(EmotionEvent(
-                    trigger=keyword,
-                    delta=self.USER_SUPPORT_HEAL,
-                    source=source,
-                    event_type="support"
-                ))
+        for i in hits[n_matched:]:
+            events.append(EmotionEvent(
+                trigger=matcher.keywords[i],
+                delta=self.USER_SUPPORT_HEAL,
+                source=source,
+                event_type="support"
+            ))
         
         return events
     
     def _is_rival(self, platform_id: str, other_id: str) -> bool:
         """检查是否是死对头关系"""
-        rel = self.relationships.get("relationships", {}).get(platform_id, {}).get(other_id, {})
-        return rel.get("type") == "rivalry" or rel.get("intensity", 0) > 0.7
+        return other_id in self._rival_set.get(platform_id, ())
     
     def apply_emotion_change(self, platform_id: str, delta: int, 
                              source: str, reason: str = "") -> Tuple[int, bool]:
@@ -174,8 +257,19 @@ class EmotionSystem:
         返回情绪变化报告
         """
         events = self.check_triggers(platform_id, message, source)
+        old_value = self.emotion_states.get(platform_id, 50)
         
-        total_delta = sum(e.delta for e in events)
+        # 一次遍历汇总变化量、触发词和支持词
+        total_delta = 0
+        triggers = []
+        supports = []
+        for event in events:
+            delta = event.delta
+            total_delta += delta
+            if delta < 0:
+                triggers.append(event.trigger)
+            elif delta > 0:
+                supports.append(event.trigger)
         
         # 自然恢复
         if total_delta >= 0:
@@ -188,11 +282,11 @@ class EmotionSystem:
         
         return {
             "platform_id": platform_id,
-            "old_value": self.emotion_states.get(platform_id, 50) - total_delta,
+            "old_value": old_value,
             "new_value": new_value,
             "delta": total_delta,
-            "triggers": [e.trigger for e in events if e.delta < 0],
-            "supports": [e.trigger for e in events if e.delta > 0],
+            "triggers": triggers,
+            "supports": supports,
             "broke": broke,
             "emotion_level": self.get_emotion_level(platform_id).value,
             "emoji": self.get_emotion_emoji(platform_id)
@@ -209,53 +303,14 @@ class EmotionSystem:
         responses = platform_secrets.get("breakpoint_responses", [])
         
         if responses:
-            return random.choice(responses)
+            return self._rng.choice(responses)
         return "...我不想说话了。"
     
-    def get_emotion_modifier(self, platform_id: str) -> dict:
+    def get_emotion_modifier(self, platform_id: str) -> Mapping[str, object]:
         """获取情绪对说话风格的影响"""
         level = self.get_emotion_level(platform_id)
         
-        modifiers = {
-            EmotionLevel.EXCITED: {
-                "speed_modifier": 1.3,
-                "exclamation_boost": True,
-                "emoji_boost": True,
-                "style_hint": "非常兴奋，语速加快，多用感叹号"
-            },
-            EmotionLevel.HAPPY: {
-                "speed_modifier": 1.1,
-                "exclamation_boost": False,
-                "emoji_boost": True,
-                "style_hint": "心情不错，语气轻松"
-            },
-            EmotionLevel.NEUTRAL: {
-                "speed_modifier": 1.0,
-                "exclamation_boost": False,
-                "emoji_boost": False,
-                "style_hint": "正常状态"
-            },
-            EmotionLevel.ANNOYED: {
-                "speed_modifier": 1.1,
-                "exclamation_boost": True,
-                "emoji_boost": False,
-                "style_hint": "有点烦躁，语气变冲"
-            },
-            EmotionLevel.ANGRY: {
-                "speed_modifier": 1.2,
-                "exclamation_boost": True,
-                "emoji_boost": False,
-                "style_hint": "很生气，可能会出言不逊"
-            },
-            EmotionLevel.BROKEN: {
-                "speed_modifier": 0.8,
-                "exclamation_boost": True,
-                "emoji_boost": False,
-                "style_hint": "情绪崩溃，可能会说出真心话或反击"
-            }
-        }
-        
-        return modifiers.get(level, modifiers[EmotionLevel.NEUTRAL])
+        return _MODIFIERS.get(level, _MODIFIERS[EmotionLevel.NEUTRAL])
     
     def get_status_display(self, platform_id: str) -> str:
         """获取情绪状态显示"""
@@ -268,16 +323,7 @@ class EmotionSystem:
         empty = 10 - filled
         bar = "█" * filled + "░" * empty
         
-        status_text = {
-            EmotionLevel.EXCITED: "嗨起来了！",
-            EmotionLevel.HAPPY: "心情不错~",
-            EmotionLevel.NEUTRAL: "正常营业",
-            EmotionLevel.ANNOYED: "有点烦...",
-            EmotionLevel.ANGRY: "快绷不住了",
-            EmotionLevel.BROKEN: "💔 破防了！"
-        }
-        
-        return f"{emoji} [{bar}] {value}/100 {status_text.get(level, '')}"
+        return f"{emoji} [{bar}] {value}/100 {_STATUS_TEXT.get(level, '')}"
 
 
 class BreakpointManager:
@@ -285,7 +331,7 @@ class BreakpointManager:
     
     def __init__(self, emotion_system: EmotionSystem):
         self.emotion_system = emotion_system
-        self.breakpoint_moments: List[dict] = []
+        self.breakpoint_moments: Deque[dict] = deque(maxlen=BREAKPOINT_MOMENTS_SIZE)
     
     def record_breakpoint(self, platform_id: str, trigger: str, 
                           context: List[str], response: str):
@@ -301,7 +347,7 @@ class BreakpointManager:
     
     def get_highlight_reel(self) -> List[dict]:
         """获取破防名场面集锦"""
-        return self.breakpoint_moments
+        return list(self.breakpoint_moments)
     
     def format_highlight(self, moment: dict) -> str:
         """格式化单个破防名场面"""
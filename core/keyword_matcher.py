@@ -0,0 +1,67 @@
+"""
+关键词匹配 - 一次扫描文本找出命中的全部关键词
+"""
+from typing import Dict, Iterable, List, Tuple
+
+try:
+    import ahocorasick
+except ImportError:  # 未安装 pyahocorasick 时逐个关键词做子串判断
+    ahocorasick = None
+
+
+class KeywordMatcher:
+    """大小写不敏感的多关键词匹配器
+
+    关键词在构造时统一转小写；安装了 pyahocorasick 时构建 Aho-Corasick 自动机，
+    对文本只扫描一遍。命中结果按关键词的原始顺序返回。
+    """
+
+    def __init__(self, keywords: Iterable[str]):
+        self.keywords: Tuple[str, ...] = tuple(keywords)
+        self.lowered: Tuple[str, ...] = tuple(kw.lower() for kw in self.keywords)
+        self._automaton = None
+
+        if ahocorasick is not None and all(self.lowered):
+            # 小写后相同的关键词共用一个节点，节点上记录它们的下标
+            indices: Dict[str, List[int]] = {}
+            for i, kw in enumerate(self.lowered):
+                indices.setdefault(kw, []).append(i)
+            automaton = ahocorasick.Automaton()
+            for kw, idx in indices.items():
+                automaton.add_word(kw, tuple(idx))
+            if indices:
+                automaton.make_automaton()
+                self._automaton = automaton
+
+    def find_indices(self, text: str, lowered: bool = False) -> List[int]:
+        """返回文本中出现的关键词下标（升序），text 已小写时传 lowered=True"""
+        if not self.keywords:
+            return []
+        if not lowered:
+            text = text.lower()
+        if self._automaton is None:
+            return [i for i, low in enumerate(self.lowered) if low in text]
+
+        return sorted({i for _, idx in self._automaton.iter(text) for i in idx})
+
+    def find_all(self, text: str, lowered: bool = False) -> List[str]:
+        """返回文本中出现的关键词（原始大小写），text 已小写时传 lowered=True"""
+        return [self.keywords[i] for i in self.find_indices(text, lowered)]
+
+    def find_any(self, texts: Iterable[str]) -> List[str]:
+        """返回在任意一段文本中出现过的关键词"""
+        # 用不会出现在关键词里的分隔符拼接，一次扫描完所有文本
+        return self.find_all("\0".join(texts))
+
+    def matches(self, text: str, lowered: bool = False) -> bool:
+        """文本中是否出现任一关键词"""
+        if not self.keywords:
+            return False
+        if not lowered:
+            text = text.lower()
+        if self._automaton is None:
+            return any(low in text for low in self.lowered)
+        return next(self._automaton.iter(text), None) is not None
+
+
+EMPTY_MATCHER = KeywordMatcher(())
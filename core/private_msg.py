@@ -1,13 +1,19 @@
 """
 私聊系统 - 管理平台与用户之间的私聊（阴谋系统）
 """
-import json
 import random
-from typing import Dict, List, Optional, Tuple
+import itertools
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
 from dataclasses import dataclass, field
 from enum import Enum
 import os
 
+try:
+    from core.config_loader import load_json_config
+except ImportError:  # 直接运行本文件时
+    from config_loader import load_json_config
+
 
 class PrivateMessageType(Enum):
     """私信类型"""
@@ -19,7 +25,7 @@ class PrivateMessageType(Enum):
     MANIPULATION = "manipulation"  # 操控请求
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class PrivateMessage:
     """私信消息"""
     sender: str                    # 发送平台
@@ -31,6 +37,52 @@ class PrivateMessage:
     consequence: Dict = field(default_factory=dict)   # 选择后果
 
 
+# 所有私信类型（关系一般时从中随机选择）
+_ALL_MESSAGE_TYPES: Tuple[PrivateMessageType, ...] = tuple(PrivateMessageType)
+
+# 各类私信给用户的选项
+_OPTIONS: Dict[PrivateMessageType, Tuple[str, ...]] = {
+    PrivateMessageType.ALLIANCE: (
+        "同意联盟，一起针对ta",
+        "保持中立，两不相帮",
+        "把这条私信截图发到群里"
+    ),
+    PrivateMessageType.GOSSIP: (
+        "有意思，记下了",
+        "别在背后说人坏话",
+        "直接在群里问ta是不是真的"
+    ),
+    PrivateMessageType.COMPLAINT: (
+        "安慰ta",
+        "确实，ta有点过分",
+        "你自己也有问题吧"
+    ),
+    PrivateMessageType.SECRET: (
+        "谢谢你的信任",
+        "这个秘密我会保守的",
+        "等等，让我截个图..."
+    ),
+    PrivateMessageType.BETRAYAL_HINT: (
+        "理解，每个人都有复杂的一面",
+        "哦？继续说",
+        "有意思，我去告诉ta"
+    ),
+    PrivateMessageType.MANIPULATION: (
+        "好的，我帮你",
+        "你们的事我不想掺和",
+        "你自己去说啊，别拉我下水"
+    )
+}
+
+# 私信历史、用户选择记录保留的条数
+PRIVATE_HISTORY_SIZE = 256
+
+
+def _last_n(items: Deque, n: int) -> List:
+    """取 deque 末尾 n 个元素（按原顺序）"""
+    return list(itertools.islice(items, max(0, len(items) - n), None))
+
+
 class PrivateMessageSystem:
     """私聊系统"""
     
@@ -45,23 +97,60 @@ class PrivateMessageSystem:
         self.relationships = self._load_config("relationships.json")
         self.secrets = self._load_config("secrets.json")
         
-        # 消息队列
+        # 各平台的死对头集合（配置加载后构建一次）
+        self._rival_set = self._build_rival_index()
+        
+        # 各平台私信用到的秘密素材（配置加载后提取一次，缺省值在取用时补）
+        platform_secrets = self.secrets.get("platform_secrets", {})
+        self._core_fears: Dict[str, str] = {
+            platform_id: secrets["vulnerability"]["core_fear"]
+            for platform_id, secrets in platform_secrets.items()
+            if "core_fear" in secrets.get("vulnerability", {})
+        }
+        self._public_shames: Dict[str, List[str]] = {
+            platform_id: secrets.get("public_shame", [])
+            for platform_id, secrets in platform_secrets.items()
+        }
+        self._private_shames: Dict[str, List[str]] = {
+            platform_id: secrets.get("private_shame", [])
+            for platform_id, secrets in platform_secrets.items()
+        }
+        self._betrayal_statements: Dict[str, str] = {
+            platform_id: triggers["betrayal_statement"]
+            for platform_id, triggers in self.secrets.get("betrayal_triggers", {}).items()
+            if "betrayal_statement" in triggers
+        }
+        
+        # 本实例专用的随机数生成器，不与其他会话共享全局随机状态
+        self._rng = random.Random()
+        
+        # 消息队列（历史只保留最近的若干条）
         self.pending_messages: List[PrivateMessage] = []
-        self.message_history: List[PrivateMessage] = []
+        self.message_history: Deque[PrivateMessage] = deque(maxlen=PRIVATE_HISTORY_SIZE)
         
-        # 用户选择记录
-        self.user_choices: List[dict] = []
+        # 用户选择记录（同上），公开次数单独累计，不受截断影响
+        self.user_choices: Deque[dict] = deque(maxlen=PRIVATE_HISTORY_SIZE)
+        self.exposed_count = 0
         self.alliance_status: Dict[str, bool] = {}  # 用户与各平台的联盟状态
     
     def _load_config(self, filename: str) -> dict:
-        """加载配置"""
+        """加载配置（文件缺失或格式错误时返回空配置）"""
         filepath = os.path.join(self.config_dir, filename)
         try:
-            with open(filepath, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except:
+            return load_json_config(filepath)
+        except (OSError, ValueError):
             return {}
     
+    def _build_rival_index(self) -> Dict[str, frozenset]:
+        """platform_id -> 死对头平台集合"""
+        return {
+            platform_id: frozenset(
+                other_id for other_id, rel in rels.items()
+                if rel.get("type") == "rivalry" or rel.get("intensity", 0) > 0.7
+            )
+            for platform_id, rels in self.relationships.get("relationships", {}).items()
+        }
+    
     def _get_platform_name(self, platform_id: str) -> str:
         """获取平台显示名称"""
         return self.platforms_config.get("platforms", {}).get(platform_id, {}).get("name", platform_id)
@@ -74,10 +163,8 @@ class PrivateMessageSystem:
         chance = self.BASE_TRIGGER_CHANCE
         
         # 死对头在场增加概率
-        for other in other_platforms:
-            rel = self.relationships.get("relationships", {}).get(platform_id, {}).get(other, {})
-            if rel.get("type") == "rivalry" or rel.get("intensity", 0) > 0.7:
-                chance += self.RIVALRY_BOOST
+        rivals = self._rival_set.get(platform_id, ())
+        chance += self.RIVALRY_BOOST * sum(1 for other in other_platforms if other in rivals)
         
         # 低情绪增加概率
         if emotion_value < 40:
@@ -87,7 +174,7 @@ class PrivateMessageSystem:
         if recent_conflict:
             chance += 0.1
         
-        return random.random() < chance
+        return self._rng.random() < chance
     
     def generate_private_message(self, sender_id: str, 
                                  target_platform: str,
@@ -104,11 +191,11 @@ class PrivateMessageSystem:
         
         # 根据关系类型选择消息类型
         if rel_type == "rivalry":
-            msg_type = random.choice([PrivateMessageType.ALLIANCE, PrivateMessageType.GOSSIP])
+            msg_type = self._rng.choice([PrivateMessageType.ALLIANCE, PrivateMessageType.GOSSIP])
         elif rel_type in ["mutual_respect", "sisters"]:
-            msg_type = random.choice([PrivateMessageType.GOSSIP, PrivateMessageType.SECRET])
+            msg_type = self._rng.choice([PrivateMessageType.GOSSIP, PrivateMessageType.SECRET])
         else:
-            msg_type = random.choice(list(PrivateMessageType))
+            msg_type = self._rng.choice(_ALL_MESSAGE_TYPES)
         
         # 生成消息内容
         content, options = self._generate_message_content(
@@ -138,117 +225,71 @@ class PrivateMessageSystem:
                                   attack_lines: List[str],
                                   secret_respect: str,
                                   context: str) -> Tuple[str, List[str]]:
-        """生成消息内容和选项"""
-        
-        templates = {
-            PrivateMessageType.ALLIANCE: {
-                "content": [
-                    f"悄悄@你：你看{target_name}那个发言，典型的xxx，我们要不要联合起来针对ta？",
-                    f"私聊你：{target_name}今天是不是有点过分了？我觉得我们应该团结一下...",
-                    f"小声说：那边说的话你信？{random.choice(attack_lines) if attack_lines else '也太那啥了'}",
-                ],
-                "options": [
-                    "同意联盟，一起针对ta",
-                    "保持中立，两不相帮",
-                    "把这条私信截图发到群里"
-                ]
-            },
-            PrivateMessageType.GOSSIP: {
-                "content": [
-                    f"偷偷告诉你：其实{target_name}私下里{secret_respect if secret_respect else '也没那么自信'}",
-                    f"你知道吗？{target_name}最怕别人说ta{self._get_fear(target_id)}",
-                    f"八卦一下：{target_name}之前被全网嘲过{self._get_public_shame(target_id)}",
-                ],
-                "options": [
-                    "有意思，记下了",
-                    "别在背后说人坏话",
-                    "直接在群里问ta是不是真的"
-                ]
-            },
-            PrivateMessageType.COMPLAINT: {
-                "content": [
-                    f"呜呜呜{target_name}刚才说的话好伤人...",
-                    f"你有没有觉得{target_name}今天针对我？",
-                    f"我是不是说错什么了？为什么{target_name}一直怼我...",
-                ],
-                "options": [
-                    "安慰ta",
-                    "确实，ta有点过分",
-                    "你自己也有问题吧"
-                ]
-            },
-            PrivateMessageType.SECRET: {
-                "content": [
-                    f"其实我有个秘密...{self._get_private_shame(sender_id)}",
-                    f"别跟别人说，{target_name}其实私下{secret_respect if secret_respect else '也挺努力的'}",
-                    f"实话跟你说，我有时候也觉得{self._get_self_doubt(sender_id)}",
-                ],
-                "options": [
-                    "谢谢你的信任",
-                    "这个秘密我会保守的",
-                    "等等，让我截个图..."
-                ]
-            },
-            PrivateMessageType.BETRAYAL_HINT: {
-                "content": [
-                    f"说实话，关于刚才的话题...我其实{self._get_betrayal_hint(sender_id)}",
-                    f"你别告诉{target_name}，但我觉得ta说的有些道理...",
-                    f"虽然我嘴上不承认，但{self._get_secret_agreement(sender_id, target_id)}",
-                ],
-                "options": [
-                    "理解，每个人都有复杂的一面",
-                    "哦？继续说",
-                    "有意思，我去告诉ta"
-                ]
-            },
-            PrivateMessageType.MANIPULATION: {
-                "content": [
-                    f"你能不能帮我问一下{target_name}是不是对我有意见？",
-                    f"下次{target_name}再说那种话，你帮我怼回去呗？",
-                    f"我觉得你比较公正，能不能帮我评评理？",
-                ],
-                "options": [
-                    "好的，我帮你",
-                    "你们的事我不想掺和",
-                    "你自己去说啊，别拉我下水"
-                ]
-            }
-        }
+        """生成消息内容和选项（只构造选中类型的文案）"""
+        if msg_type == PrivateMessageType.ALLIANCE:
+            contents = [
+                f"悄悄@你：你看{target_name}那个发言，典型的xxx，我们要不要联合起来针对ta？",
+                f"私聊你：{target_name}今天是不是有点过分了？我觉得我们应该团结一下...",
+                f"小声说：那边说的话你信？{self._rng.choice(attack_lines) if attack_lines else '也太那啥了'}",
+            ]
+        elif msg_type == PrivateMessageType.COMPLAINT:
+            contents = [
+                f"呜呜呜{target_name}刚才说的话好伤人...",
+                f"你有没有觉得{target_name}今天针对我？",
+                f"我是不是说错什么了？为什么{target_name}一直怼我...",
+            ]
+        elif msg_type == PrivateMessageType.SECRET:
+            contents = [
+                f"其实我有个秘密...{self._get_private_shame(sender_id)}",
+                f"别跟别人说，{target_name}其实私下{secret_respect if secret_respect else '也挺努力的'}",
+                f"实话跟你说，我有时候也觉得{self._get_self_doubt(sender_id)}",
+            ]
+        elif msg_type == PrivateMessageType.BETRAYAL_HINT:
+            contents = [
+                f"说实话，关于刚才的话题...我其实{self._get_betrayal_hint(sender_id)}",
+                f"你别告诉{target_name}，但我觉得ta说的有些道理...",
+                f"虽然我嘴上不承认，但{self._get_secret_agreement(sender_id, target_id)}",
+            ]
+        elif msg_type == PrivateMessageType.MANIPULATION:
+            contents = [
+                f"你能不能帮我问一下{target_name}是不是对我有意见？",
+                f"下次{target_name}再说那种话，你帮我怼回去呗？",
+                f"我觉得你比较公正，能不能帮我评评理？",
+            ]
+        else:  # GOSSIP，未知类型也按八卦处理
+            msg_type = PrivateMessageType.GOSSIP
+            contents = [
+                f"偷偷告诉你：其实{target_name}私下里{secret_respect if secret_respect else '也没那么自信'}",
+                f"你知道吗？{target_name}最怕别人说ta{self._get_fear(target_id)}",
+                f"八卦一下：{target_name}之前被全网嘲过{self._get_public_shame(target_id)}",
+            ]
         
-        template = templates.get(msg_type, templates[PrivateMessageType.GOSSIP])
-        content = random.choice(template["content"])
-        options = template["options"]
+        content = self._rng.choice(contents)
+        options = list(_OPTIONS[msg_type])
         
         return content, options
     
     def _get_fear(self, platform_id: str) -> str:
         """获取平台的恐惧"""
-        secrets = self.secrets.get("platform_secrets", {}).get(platform_id, {})
-        vulnerability = secrets.get("vulnerability", {})
-        return vulnerability.get("core_fear", "xxx")[:30] + "..."
+        return self._core_fears.get(platform_id, "xxx")[:30] + "..."
     
     def _get_public_shame(self, platform_id: str) -> str:
         """获取公开黑历史"""
-        secrets = self.secrets.get("platform_secrets", {}).get(platform_id, {})
-        shames = secrets.get("public_shame", [])
-        return random.choice(shames) if shames else "的事"
+        shames = self._public_shames.get(platform_id)
+        return self._rng.choice(shames) if shames else "的事"
     
     def _get_private_shame(self, platform_id: str) -> str:
         """获取私密黑历史"""
-        secrets = self.secrets.get("platform_secrets", {}).get(platform_id, {})
-        shames = secrets.get("private_shame", [])
-        return random.choice(shames) if shames else "有些事不太想提"
+        shames = self._private_shames.get(platform_id)
+        return self._rng.choice(shames) if shames else "有些事不太想提"
     
     def _get_self_doubt(self, platform_id: str) -> str:
         """获取自我怀疑"""
-        secrets = self.secrets.get("platform_secrets", {}).get(platform_id, {})
-        vulnerability = secrets.get("vulnerability", {})
-        return vulnerability.get("core_fear", "我是不是做错了什么")
+        return self._core_fears.get(platform_id, "我是不是做错了什么")
     
     def _get_betrayal_hint(self, platform_id: str) -> str:
         """获取叛变暗示"""
-        triggers = self.secrets.get("betrayal_triggers", {}).get(platform_id, {})
-        return triggers.get("betrayal_statement", "也不是完全不同意对方的看法")
+        return self._betrayal_statements.get(platform_id, "也不是完全不同意对方的看法")
     
     def _get_secret_agreement(self, sender_id: str, target_id: str) -> str:
         """获取秘密认同"""
@@ -296,6 +337,8 @@ class PrivateMessageSystem:
             "choice": choice_index,
             "result": result
         })
+        if result["exposed"]:
+            self.exposed_count += 1
         
         # 更新联盟状态
         if result["alliance_formed"]:
@@ -353,7 +396,7 @@ class PrivateMessageSystem:
     
     def get_betrayal_count(self) -> int:
         """获取被背叛/背叛别人的次数"""
-        return sum(1 for choice in self.user_choices if choice.get("result", {}).get("exposed"))
+        return self.exposed_count
 
 
 class ConversationDrama:
@@ -362,11 +405,12 @@ class ConversationDrama:
     def __init__(self, private_system: PrivateMessageSystem):
         self.private_system = private_system
         self.drama_events: List[dict] = []
+        self._rng = random.Random()
     
     def check_for_drama(self, recent_messages: List[dict]) -> Optional[dict]:
         """检查是否有戏剧性事件发生"""
         # 检查用户的选择是否引发了戏剧性后果
-        for choice in self.private_system.user_choices[-3:]:  # 最近3个选择
+        for choice in _last_n(self.private_system.user_choices, 3):  # 最近3个选择
             if choice.get("result", {}).get("exposed"):
                 return {
                     "type": "exposure",
@@ -393,7 +437,7 @@ class ConversationDrama:
                     "呵，早就知道你们在背后嚼舌根",
                     "有什么话不能当面说？"
                 ]
-            return random.choice(responses)
+            return self._rng.choice(responses)
         
         return ""
 
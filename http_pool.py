@@ -0,0 +1,29 @@
+"""
+共享 HTTP 连接池 - 进程内所有 LLM 服务商复用同一个 httpx.AsyncClient
+"""
+
+_CLIENT = None
+
+
+def get():
+    """获取共享客户端（首次调用时创建，关闭后再调用会重新创建）"""
+    global _CLIENT
+    if _CLIENT is None or _CLIENT.is_closed:
+        import httpx
+        _CLIENT = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=200,
+                max_keepalive_connections=50,
+                keepalive_expiry=600
+            ),
+            timeout=httpx.Timeout(30.0, connect=5.0)
+        )
+    return _CLIENT
+
+
+async def aclose():
+    """关闭共享客户端（服务退出前调用）"""
+    global _CLIENT
+    client, _CLIENT = _CLIENT, None
+    if client is not None:
+        await client.aclose()
@@ -70,7 +70,7 @@ PLATFORM_VOICE_IDS = {
 import sys
 sys.path.insert(0, str(BASE_DIR))
 
-from chatbot import PlatformChatBot, DeepSeekAPI, GLM4API, MockLLM, PLATFORMS as BOT_PLATFORMS
+from chatbot import PlatformChatBot, DeepSeekAPI, GLM4API, MockLLM, close_llm_clients, PLATFORMS as BOT_PLATFORMS
 
 # ==================== 数据模型 ====================
 
@@ -185,6 +185,7 @@ async def lifespan(app: FastAPI):
     logger.info("Platform Chat Server starting...")
     yield
     logger.info("Platform Chat Server shutting down...")
+    await close_llm_clients()
 
 app = FastAPI(
     title="平台人格群聊系统",